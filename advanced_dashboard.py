@@ -4,6 +4,350 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import numpy as np
+from io import BytesIO
+import zipfile
+from openpyxl import Workbook
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# st.fragment (أو اسمه التجريبي في الإصدارات الأقدم) يعيد تشغيل جزء من الصفحة فقط عند التفاعل معه
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+# أنماط CSS ونص الشرح ثابتة، لذا تُعرّف مرة واحدة عند تحميل الوحدة
+_CSS = """
+<style>
+    .big-font { font-size: 3rem !important; font-weight: bold; }
+    .medium-font { font-size: 1.5rem !important; }
+    .kpi-card { 
+        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+        padding: 20px;
+        border-radius: 15px;
+        color: white;
+        margin: 10px;
+    }
+    .warning-card { 
+        background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
+        padding: 20px;
+        border-radius: 15px;
+        color: white;
+        margin: 10px;
+    }
+    .success-card { 
+        background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
+        padding: 20px;
+        border-radius: 15px;
+        color: white;
+        margin: 10px;
+    }
+</style>
+"""
+
+_HELP_MD = """
+### 💡 ما هو الداشبورد؟
+**الداشبورد** هو لوحة تحكم شاملة تعرض جميع مؤشرات الأداء والتحليلات في مكان واحد.
+
+### 📊 الأقسام الستة:
+
+#### 1️⃣ المؤشرات الرئيسية (KPIs)
+**ماذا تعرض:**
+- عدد الخدمات النشطة
+- إجمالي الطاقة الشهرية
+- التكاليف الشهرية
+- متوسط تكلفة الوحدة
+
+**كيف تستفيد:**
+- نظرة سريعة على حجم عملياتك
+- معرفة التكاليف الإجمالية
+- مقارنة بين الفترات المختلفة
+
+#### 2️⃣ تحليل الربحية
+**ماذا تعرض:**
+- توزيع الإيرادات حسب الخدمة
+- مقارنة التكاليف vs الإيرادات
+- اتجاه نمو الإيرادات
+
+**كيف تستفيد:**
+- تحديد الخدمات الأكثر ربحية
+- اكتشاف فرص النمو
+- تحسين استراتيجية التسعير
+
+#### 3️⃣ تحليل الطاقة والاستغلال
+**ماذا تعرض:**
+- نسبة استغلال كل خدمة
+- الهدر في الطاقة
+- توصيات لزيادة الاستغلال
+
+**كيف تستفيد:**
+- معرفة الخدمات ذات الاستغلال المنخفض
+- تحديد فرص تحسين الكفاءة
+- حساب تكلفة الهدر
+
+#### 4️⃣ تحليل الخدمات
+**ماذا تعرض:**
+- أداء كل خدمة
+- المساهمة في الإيرادات
+- هامش الربح لكل خدمة
+
+**كيف تستفيد:**
+- تحديد الخدمات ذات القيمة العالية
+- اكتشاف الخدمات التي تحتاج تحسين
+- إعادة تقييم الأسعار
+
+#### 5️⃣ التنبيهات والتوصيات
+**ماذا تعرض:**
+- تحذيرات عن الخدمات ذات هامش ربح منخفض
+- توصيات لزيادة الإيرادات
+- نصائح لتحسين الكفاءة
+
+**كيف تستفيد:**
+- اتخاذ قرارات مبنية على البيانات
+- تحسين العمليات
+- زيادة الربحية
+
+#### 6️⃣ التقارير السريعة
+**ماذا تعرض:**
+- تقارير Excel جاهزة للتحميل
+- ملخص الأداء
+- تفاصيل الخدمات
+
+**كيف تستفيد:**
+- مشاركة التقارير مع الإدارة
+- حفظ نسخ احتياطية
+- التحليل الخارجي
+
+### 🎯 نصائح للاستفادة القصوى:
+
+**يومياً:**
+- راجع المؤشرات الرئيسية
+- تابع التنبيهات الجديدة
+
+**أسبوعياً:**
+- راجع تحليل الربحية
+- تحقق من استغلال الطاقة
+
+**شهرياً:**
+- راجع جميع الأقسام بالتفصيل
+- حمّل التقارير للأرشفة
+- قارن الأداء بالأشهر السابقة
+
+### ⚠️ تذكير:
+الداشبورد يعتمد على البيانات المدخلة. كلما كانت بياناتك دقيقة، كانت التحليلات أكثر فائدة!
+"""
+
+# تنسيق الأعمدة الرقمية في الجداول (يتم في المتصفح بدلاً من Styler، بنفس تنسيق جداول app.py)
+_UNITS_COLUMN = st.column_config.NumberColumn(format='%.0f')
+_SAR_COLUMN = st.column_config.NumberColumn(format='%.2f ر.س')
+
+
+@st.cache_data(show_spinner=False)
+def _aggregate(_capacity_df, source, mtime):
+    """مجاميع المجموعات والإجماليات لجميع الأقسام (تُحسب مرة واحدة لكل نسخة من ملف الطاقة)"""
+    agg = _capacity_df.groupby('service_group', observed=True).agg(
+        monthly_cost=('monthly_cost', 'sum'),
+        monthly_capacity=('monthly_capacity', 'sum'),
+        count=('service_key', 'size')
+    ).reset_index()
+    totals = _capacity_df[['monthly_capacity', 'monthly_cost', 'cost_per_unit']].agg(['sum', 'mean'])
+    return agg, totals
+
+
+@st.cache_data(show_spinner=False)
+def _cost_by_group_pie(cost_by_group):
+    """رسم دائري للتكاليف حسب المجموعة"""
+    fig = px.pie(
+        cost_by_group, 
+        values='monthly_cost', 
+        names='service_group',
+        title='توزيع التكاليف حسب المجموعة',
+        hole=0.4
+    )
+    fig.update_traces(textposition='inside', textinfo='percent+label')
+    return fig
+
+
+@st.cache_data(show_spinner=False)
+def _capacity_by_group_bar(capacity_by_group):
+    """رسم أعمدة للطاقة حسب المجموعة"""
+    return px.bar(
+        capacity_by_group,
+        x='service_group',
+        y='monthly_capacity',
+        title='الطاقة الإجمالية حسب المجموعة',
+        color='monthly_capacity',
+        color_continuous_scale='Blues'
+    )
+
+
+@st.cache_data(show_spinner=False)
+def _waste_chart(waste_data):
+    """رسم الطاقة المستخدمة مقابل المهدرة لكل خدمة"""
+    names = waste_data['service_name'].to_numpy()
+    used = waste_data['assumed_usage'].to_numpy()
+    waste = waste_data['waste_capacity'].to_numpy()
+    
+    fig = go.Figure()
+    
+    fig.add_trace(go.Bar(
+        name='الطاقة المستخدمة',
+        x=names,
+        y=used,
+        marker_color='lightblue'
+    ))
+    
+    fig.add_trace(go.Bar(
+        name='الطاقة المهدرة',
+        x=names,
+        y=waste,
+        marker_color='salmon'
+    ))
+    
+    fig.update_layout(
+        title='تحليل الطاقة المستخدمة vs المهدرة',
+        xaxis_title='الخدمة',
+        yaxis_title='الطاقة',
+        barmode='stack',
+        height=500
+    )
+    return fig
+
+
+@st.cache_data(show_spinner=False)
+def _group_count_pie(group_count):
+    """رسم دائري لتوزيع الخدمات حسب المجموعة"""
+    return px.pie(
+        group_count,
+        values='count',
+        names='service_group',
+        title='توزيع الخدمات حسب المجموعة'
+    )
+
+
+@st.cache_data(show_spinner=False)
+def _cost_per_unit_bar(cost_comparison):
+    """رسم أعمدة لتكلفة الوحدة لكل خدمة"""
+    fig = px.bar(
+        cost_comparison,
+        x='service_name',
+        y='cost_per_unit',
+        color='service_group',
+        title='تكلفة الوحدة لكل خدمة',
+        labels={'cost_per_unit': 'تكلفة الوحدة (ر.س)', 'service_name': 'الخدمة'}
+    )
+    fig.update_xaxes(tickangle=-45)
+    return fig
+
+
+def _waste_columns(cap, cpu):
+    """حساب الطاقة المستخدمة والمهدرة وتكلفة الهدر (بافتراض 70% استخدام)"""
+    usage = cap * 0.7
+    waste = cap - usage
+    return usage, waste, waste * cpu
+
+
+def _profit_columns(cost):
+    """حساب الإيراد والربح وهامش الربح المقدرة من مصفوفة التكاليف"""
+    revenue = cost * 1.25
+    profit = revenue - cost
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margin = profit / revenue * 100
+    return revenue, profit, margin
+
+
+_REPORT_FILES = {
+    "تقرير شامل": ("📥 تحميل التقرير الشامل", "comprehensive_report.xlsx"),
+    "تقرير التكاليف": ("📥 تحميل تقرير التكاليف", "cost_report.xlsx"),
+    "تقرير الطاقة": ("📥 تحميل تقرير الطاقة", "capacity_report.xlsx"),
+    "تقرير الأسعار": ("📥 تحميل تقرير الأسعار", "pricing_report.xlsx"),
+}
+
+
+def _summary_frame(capacity_df, totals):
+    """جدول الملخص التنفيذي للتقرير الشامل"""
+    return pd.DataFrame({
+        'المؤشر': [
+            'إجمالي الطاقة الشهرية',
+            'إجمالي التكاليف الشهرية',
+            'عدد الخدمات',
+            'متوسط تكلفة الوحدة'
+        ],
+        'القيمة': [
+            f"{totals.at['sum', 'monthly_capacity']:,.0f}",
+            f"{totals.at['sum', 'monthly_cost']:,.2f} ر.س",
+            len(capacity_df),
+            f"{totals.at['mean', 'cost_per_unit']:,.2f} ر.س"
+        ]
+    })
+
+
+def _write_single_sheet(df, buffer):
+    """كتابة جدول واحد إلى ملف Excel"""
+    if xlsxwriter is not None:
+        df.to_excel(buffer, index=False, engine='xlsxwriter')
+        return
+    
+    # بدون xlsxwriter: وضع openpyxl للكتابة فقط يبث الصفوف مباشرة دون بناء شبكة الخلايا
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(df.columns))
+    for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+        ws.append(row)
+    wb.save(buffer)
+
+
+@st.cache_data(show_spinner=False)
+def _build_excel(report_type, capacity_df, pricing_df, totals):
+    """بناء ملف Excel للتقرير المطلوب وإرجاعه كبايتات"""
+    buffer = BytesIO()
+    
+    if report_type == "تقرير شامل":
+        with pd.ExcelWriter(buffer, engine='xlsxwriter' if xlsxwriter is not None else 'openpyxl') as writer:
+            capacity_df.to_excel(writer, sheet_name='الطاقة الاستيعابية', index=False)
+            pricing_df.to_excel(writer, sheet_name='شرائح الأسعار', index=False)
+            
+            # تقرير ملخص
+            summary = _summary_frame(capacity_df, totals)
+            summary.to_excel(writer, sheet_name='الملخص التنفيذي', index=False)
+    
+    elif report_type == "تقرير التكاليف":
+        cost_report = capacity_df[['service_name', 'service_group', 'monthly_cost', 'cost_per_unit']]
+        _write_single_sheet(cost_report, buffer)
+    
+    elif report_type == "تقرير الطاقة":
+        capacity_report = capacity_df[['service_name', 'capacity_type', 'daily_capacity', 'monthly_capacity']]
+        _write_single_sheet(capacity_report, buffer)
+    
+    elif report_type == "تقرير الأسعار":
+        _write_single_sheet(pricing_df, buffer)
+    
+    return buffer.getvalue()
+
+
+@st.cache_data(show_spinner=False)
+def _build_archive(report_format, capacity_df, pricing_df, totals):
+    """بناء التقرير الشامل كملف ZIP بصيغة Parquet أو CSV مضغوط (zstd)"""
+    tables = {
+        'capacity': capacity_df,
+        'pricing': pricing_df,
+        'summary': _summary_frame(capacity_df, totals).astype(str)
+    }
+    
+    ext = '.parquet' if report_format == "Parquet" else '.csv.zst'
+    
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, df in tables.items():
+            part = BytesIO()
+            if report_format == "Parquet":
+                df.to_parquet(part, engine='pyarrow', compression='zstd', index=False)
+            else:
+                df.to_csv(part, index=False, compression={'method': 'zstd', 'level': 3})
+            archive.writestr(f"{name}{ext}", part.getvalue())
+    
+    return buffer.getvalue()
+
 
 class AdvancedDashboard:
     def __init__(self, pricing_system):
@@ -12,132 +356,16 @@ class AdvancedDashboard:
     def show_professional_dashboard(self):
         """عرض الداشبورد الاحترافي المتكامل"""
         
-        st.markdown("""
-        <style>
-            .big-font { font-size: 3rem !important; font-weight: bold; }
-            .medium-font { font-size: 1.5rem !important; }
-            .kpi-card { 
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                padding: 20px;
-                border-radius: 15px;
-                color: white;
-                margin: 10px;
-            }
-            .warning-card { 
-                background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-                padding: 20px;
-                border-radius: 15px;
-                color: white;
-                margin: 10px;
-            }
-            .success-card { 
-                background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
-                padding: 20px;
-                border-radius: 15px;
-                color: white;
-                margin: 10px;
-            }
-        </style>
-        """, unsafe_allow_html=True)
+        st.markdown(_CSS, unsafe_allow_html=True)
         
         # العنوان الرئيسي
         st.markdown('<div class="main-header">📊 الداشبورد الاحترافي - متالى للتسعير</div>', unsafe_allow_html=True)
         
         # شرح الداشبورد
         with st.expander("📖 كيف تقرأ وتستفيد من الداشبورد؟", expanded=False):
-            st.markdown("""
-            ### 💡 ما هو الداشبورد؟
-            **الداشبورد** هو لوحة تحكم شاملة تعرض جميع مؤشرات الأداء والتحليلات في مكان واحد.
-            
-            ### 📊 الأقسام الستة:
-            
-            #### 1️⃣ المؤشرات الرئيسية (KPIs)
-            **ماذا تعرض:**
-            - عدد الخدمات النشطة
-            - إجمالي الطاقة الشهرية
-            - التكاليف الشهرية
-            - متوسط تكلفة الوحدة
-            
-            **كيف تستفيد:**
-            - نظرة سريعة على حجم عملياتك
-            - معرفة التكاليف الإجمالية
-            - مقارنة بين الفترات المختلفة
-            
-            #### 2️⃣ تحليل الربحية
-            **ماذا تعرض:**
-            - توزيع الإيرادات حسب الخدمة
-            - مقارنة التكاليف vs الإيرادات
-            - اتجاه نمو الإيرادات
-            
-            **كيف تستفيد:**
-            - تحديد الخدمات الأكثر ربحية
-            - اكتشاف فرص النمو
-            - تحسين استراتيجية التسعير
-            
-            #### 3️⃣ تحليل الطاقة والاستغلال
-            **ماذا تعرض:**
-            - نسبة استغلال كل خدمة
-            - الهدر في الطاقة
-            - توصيات لزيادة الاستغلال
-            
-            **كيف تستفيد:**
-            - معرفة الخدمات ذات الاستغلال المنخفض
-            - تحديد فرص تحسين الكفاءة
-            - حساب تكلفة الهدر
-            
-            #### 4️⃣ تحليل الخدمات
-            **ماذا تعرض:**
-            - أداء كل خدمة
-            - المساهمة في الإيرادات
-            - هامش الربح لكل خدمة
-            
-            **كيف تستفيد:**
-            - تحديد الخدمات ذات القيمة العالية
-            - اكتشاف الخدمات التي تحتاج تحسين
-            - إعادة تقييم الأسعار
-            
-            #### 5️⃣ التنبيهات والتوصيات
-            **ماذا تعرض:**
-            - تحذيرات عن الخدمات ذات هامش ربح منخفض
-            - توصيات لزيادة الإيرادات
-            - نصائح لتحسين الكفاءة
-            
-            **كيف تستفيد:**
-            - اتخاذ قرارات مبنية على البيانات
-            - تحسين العمليات
-            - زيادة الربحية
-            
-            #### 6️⃣ التقارير السريعة
-            **ماذا تعرض:**
-            - تقارير Excel جاهزة للتحميل
-            - ملخص الأداء
-            - تفاصيل الخدمات
-            
-            **كيف تستفيد:**
-            - مشاركة التقارير مع الإدارة
-            - حفظ نسخ احتياطية
-            - التحليل الخارجي
-            
-            ### 🎯 نصائح للاستفادة القصوى:
-            
-            **يومياً:**
-            - راجع المؤشرات الرئيسية
-            - تابع التنبيهات الجديدة
-            
-            **أسبوعياً:**
-            - راجع تحليل الربحية
-            - تحقق من استغلال الطاقة
-            
-            **شهرياً:**
-            - راجع جميع الأقسام بالتفصيل
-            - حمّل التقارير للأرشفة
-            - قارن الأداء بالأشهر السابقة
-            
-            ### ⚠️ تذكير:
-            الداشبورد يعتمد على البيانات المدخلة. كلما كانت بياناتك دقيقة، كانت التحليلات أكثر فائدة!
-            """)
+            st.markdown(_HELP_MD)
         
-        # تحميل البيانات
+        # تحميل البيانات (المحمّلات مخزنة مؤقتاً حسب وقت تعديل الملف)
         capacity_df = self.ps.load_capacity_data()
         pricing_df = self.ps.load_pricing_data()
         
@@ -150,32 +378,43 @@ class AdvancedDashboard:
             """)
             return
         
+        # تحويل أعمدة التجميع إلى فئات لتسريع groupby
+        capacity_df = capacity_df.astype({
+            'service_group': 'category',
+            'capacity_type': 'category'
+        })
+        
+        # تجميع البيانات مرة واحدة لجميع الأقسام (مخزن حسب وقت تعديل ملف الطاقة)
+        capacity_file = self.ps.capacity_file
+        capacity_mtime = capacity_file.stat().st_mtime_ns if capacity_file.exists() else 0
+        agg, totals = _aggregate(capacity_df, str(capacity_file), capacity_mtime)
+        
         # مؤشرات الأداء الرئيسية (KPIs)
-        self._show_main_kpis(capacity_df)
+        self._show_main_kpis(capacity_df, totals)
         
         # تحليل الربحية
-        self._show_profitability_analysis(capacity_df, pricing_df)
+        self._show_profitability_analysis(capacity_df, pricing_df, agg)
         
         # تحليل الطاقة والهدر
         self._show_capacity_analysis(capacity_df)
         
         # تحليل الخدمات
-        self._show_services_analysis(capacity_df)
+        self._show_services_analysis(capacity_df, agg)
         
         # الإنذارات والتوصيات
-        self._show_alerts_recommendations(capacity_df)
+        self._show_alerts_recommendations(capacity_df, totals)
         
         # التقارير السريعة
-        self._show_quick_reports(capacity_df, pricing_df)
+        self._show_quick_reports(capacity_df, pricing_df, totals)
     
-    def _show_main_kpis(self, capacity_df):
+    def _show_main_kpis(self, capacity_df, totals):
         """عرض مؤشرات الأداء الرئيسية"""
         
         st.markdown("### 📈 مؤشرات الأداء الرئيسية (KPIs)")
         
         # حساب المؤشرات
-        total_monthly_capacity = capacity_df['monthly_capacity'].sum()
-        total_monthly_cost = capacity_df['monthly_cost'].sum()
+        total_monthly_capacity = totals.at['sum', 'monthly_capacity']
+        total_monthly_cost = totals.at['sum', 'monthly_cost']
         total_services = len(capacity_df)
         estimated_revenue = total_monthly_cost * 1.3  # تقدير الإيراد
         
@@ -217,7 +456,7 @@ class AdvancedDashboard:
             </div>
             """, unsafe_allow_html=True)
     
-    def _show_profitability_analysis(self, capacity_df, pricing_df):
+    def _show_profitability_analysis(self, capacity_df, pricing_df, agg):
         """تحليل الربحية"""
         st.markdown("### 💰 تحليل الربحية")
         
@@ -225,46 +464,35 @@ class AdvancedDashboard:
         
         with col1:
             # رسم بياني دائري للتكاليف حسب المجموعة
-            cost_by_group = capacity_df.groupby('service_group')['monthly_cost'].sum().reset_index()
-            fig = px.pie(
-                cost_by_group, 
-                values='monthly_cost', 
-                names='service_group',
-                title='توزيع التكاليف حسب المجموعة',
-                hole=0.4
-            )
-            fig.update_traces(textposition='inside', textinfo='percent+label')
+            cost_by_group = agg[['service_group', 'monthly_cost']]
+            fig = _cost_by_group_pie(cost_by_group)
             st.plotly_chart(fig, use_container_width=True)
         
         with col2:
             # رسم بياني للطاقة حسب المجموعة
-            capacity_by_group = capacity_df.groupby('service_group')['monthly_capacity'].sum().reset_index()
-            fig = px.bar(
-                capacity_by_group,
-                x='service_group',
-                y='monthly_capacity',
-                title='الطاقة الإجمالية حسب المجموعة',
-                color='monthly_capacity',
-                color_continuous_scale='Blues'
-            )
+            capacity_by_group = agg[['service_group', 'monthly_capacity']]
+            fig = _capacity_by_group_bar(capacity_by_group)
             st.plotly_chart(fig, use_container_width=True)
         
         # جدول تحليل الربحية حسب الخدمة
         st.markdown("#### تحليل تفصيلي حسب الخدمة")
-        analysis_df = capacity_df[['service_name', 'service_group', 'monthly_capacity', 'monthly_cost', 'cost_per_unit']].copy()
-        analysis_df['estimated_revenue'] = analysis_df['monthly_cost'] * 1.25
-        analysis_df['estimated_profit'] = analysis_df['estimated_revenue'] - analysis_df['monthly_cost']
-        analysis_df['profit_margin_%'] = (analysis_df['estimated_profit'] / analysis_df['estimated_revenue'] * 100).round(2)
+        revenue, profit, margin = _profit_columns(capacity_df['monthly_cost'].to_numpy(dtype='float64'))
+        analysis_df = capacity_df[['service_name', 'service_group', 'monthly_capacity', 'monthly_cost', 'cost_per_unit']].assign(
+            estimated_revenue=revenue,
+            estimated_profit=profit,
+            **{'profit_margin_%': np.round(margin, 2)}
+        )
         
         st.dataframe(
-            analysis_df.style.format({
-                'monthly_capacity': '{:,.0f}',
-                'monthly_cost': '{:,.2f} ر.س',
-                'cost_per_unit': '{:,.2f} ر.س',
-                'estimated_revenue': '{:,.2f} ر.س',
-                'estimated_profit': '{:,.2f} ر.س',
-                'profit_margin_%': '{:.2f}%'
-            }),
+            analysis_df,
+            column_config={
+                'monthly_capacity': _UNITS_COLUMN,
+                'monthly_cost': _SAR_COLUMN,
+                'cost_per_unit': _SAR_COLUMN,
+                'estimated_revenue': _SAR_COLUMN,
+                'estimated_profit': _SAR_COLUMN,
+                'profit_margin_%': st.column_config.NumberColumn(format='%.2f%%')
+            },
             use_container_width=True,
             height=400
         )
@@ -274,10 +502,14 @@ class AdvancedDashboard:
         st.markdown("### 📊 تحليل الطاقة والهدر")
         
         # حساب الاستخدام الافتراضي (70%)
-        capacity_df_analysis = capacity_df.copy()
-        capacity_df_analysis['assumed_usage'] = capacity_df_analysis['monthly_capacity'] * 0.7
-        capacity_df_analysis['waste_capacity'] = capacity_df_analysis['monthly_capacity'] - capacity_df_analysis['assumed_usage']
-        capacity_df_analysis['waste_cost'] = capacity_df_analysis['waste_capacity'] * capacity_df_analysis['cost_per_unit']
+        cap = capacity_df['monthly_capacity'].to_numpy()
+        cpu = capacity_df['cost_per_unit'].to_numpy()
+        usage, waste, waste_cost = _waste_columns(cap, cpu)
+        capacity_df_analysis = capacity_df.assign(
+            assumed_usage=usage,
+            waste_capacity=waste,
+            waste_cost=waste_cost
+        )
         
         col1, col2 = st.columns(2)
         
@@ -302,54 +534,33 @@ class AdvancedDashboard:
             """, unsafe_allow_html=True)
         
         # رسم بياني للهدر حسب الخدمة
-        fig = go.Figure()
-        
-        fig.add_trace(go.Bar(
-            name='الطاقة المستخدمة',
-            x=capacity_df_analysis['service_name'],
-            y=capacity_df_analysis['assumed_usage'],
-            marker_color='lightblue'
-        ))
-        
-        fig.add_trace(go.Bar(
-            name='الطاقة المهدرة',
-            x=capacity_df_analysis['service_name'],
-            y=capacity_df_analysis['waste_capacity'],
-            marker_color='salmon'
-        ))
-        
-        fig.update_layout(
-            title='تحليل الطاقة المستخدمة vs المهدرة',
-            xaxis_title='الخدمة',
-            yaxis_title='الطاقة',
-            barmode='stack',
-            height=500
-        )
+        fig = _waste_chart(capacity_df_analysis[['service_name', 'assumed_usage', 'waste_capacity']])
         
         st.plotly_chart(fig, use_container_width=True)
         
         # جدول تفصيلي للهدر
         st.markdown("#### تفاصيل الهدر حسب الخدمة")
-        waste_df = capacity_df_analysis[['service_name', 'monthly_capacity', 'assumed_usage', 'waste_capacity', 'cost_per_unit', 'waste_cost']].copy()
+        waste_df = capacity_df_analysis[['service_name', 'monthly_capacity', 'assumed_usage', 'waste_capacity', 'cost_per_unit', 'waste_cost']]
         waste_df = waste_df.sort_values('waste_cost', ascending=False)
         
         st.dataframe(
-            waste_df.style.format({
-                'monthly_capacity': '{:,.0f}',
-                'assumed_usage': '{:,.0f}',
-                'waste_capacity': '{:,.0f}',
-                'cost_per_unit': '{:,.2f} ر.س',
-                'waste_cost': '{:,.2f} ر.س'
-            }),
+            waste_df,
+            column_config={
+                'monthly_capacity': _UNITS_COLUMN,
+                'assumed_usage': _UNITS_COLUMN,
+                'waste_capacity': _UNITS_COLUMN,
+                'cost_per_unit': _SAR_COLUMN,
+                'waste_cost': _SAR_COLUMN
+            },
             use_container_width=True
         )
     
-    def _show_services_analysis(self, capacity_df):
+    def _show_services_analysis(self, capacity_df, agg):
         """تحليل الخدمات"""
         st.markdown("### 🛠️ تحليل الخدمات")
         
         # تحليل حسب نوع الطاقة
-        capacity_type_analysis = capacity_df.groupby('capacity_type').agg({
+        capacity_type_analysis = capacity_df.groupby('capacity_type', observed=True).agg({
             'service_key': 'count',
             'monthly_capacity': 'sum',
             'monthly_cost': 'sum'
@@ -361,41 +572,35 @@ class AdvancedDashboard:
         with col1:
             st.markdown("#### التوزيع حسب نوع الطاقة")
             st.dataframe(
-                capacity_type_analysis.style.format({
-                    'الطاقة الإجمالية': '{:,.0f}',
-                    'التكلفة الإجمالية': '{:,.2f} ر.س'
-                }),
+                capacity_type_analysis,
+                column_config={
+                    'الطاقة الإجمالية': _UNITS_COLUMN,
+                    'التكلفة الإجمالية': _SAR_COLUMN
+                },
                 use_container_width=True
             )
         
         with col2:
             # رسم بياني دائري لتوزيع الخدمات حسب المجموعة
-            group_count = capacity_df.groupby('service_group').size().reset_index(name='count')
-            fig = px.pie(
-                group_count,
-                values='count',
-                names='service_group',
-                title='توزيع الخدمات حسب المجموعة'
-            )
+            group_count = agg[['service_group', 'count']]
+            fig = _group_count_pie(group_count)
             st.plotly_chart(fig, use_container_width=True)
         
         # مقارنة تكلفة الوحدة
         st.markdown("#### مقارنة تكلفة الوحدة")
-        cost_comparison = capacity_df[['service_name', 'service_group', 'cost_per_unit', 'monthly_capacity']].copy()
-        cost_comparison = cost_comparison.sort_values('cost_per_unit', ascending=False)
-        
-        fig = px.bar(
-            cost_comparison,
-            x='service_name',
-            y='cost_per_unit',
-            color='service_group',
-            title='تكلفة الوحدة لكل خدمة',
-            labels={'cost_per_unit': 'تكلفة الوحدة (ر.س)', 'service_name': 'الخدمة'}
-        )
-        fig.update_xaxes(tickangle=-45)
+        top_n = len(capacity_df)
+        if top_n > 10:
+            top_n = st.slider("عدد الخدمات المعروضة", 10, 100, 25)
+        
+        # أعلى الخدمات تكلفة فقط (مرتبة تنازلياً) للحد من حجم الرسم
+        cost_comparison = capacity_df.nlargest(top_n, 'cost_per_unit')[
+            ['service_name', 'service_group', 'cost_per_unit', 'monthly_capacity']
+        ]
+        
+        fig = _cost_per_unit_bar(cost_comparison)
         st.plotly_chart(fig, use_container_width=True)
     
-    def _show_alerts_recommendations(self, capacity_df):
+    def _show_alerts_recommendations(self, capacity_df, totals):
         """الإنذارات والتوصيات"""
         st.markdown("### ⚠️ الإنذارات والتوصيات")
         
@@ -403,12 +608,13 @@ class AdvancedDashboard:
         recommendations = []
         
         # تحليل التكاليف العالية
-        high_cost_services = capacity_df[capacity_df['cost_per_unit'] > capacity_df['cost_per_unit'].mean()]
-        if len(high_cost_services) > 0:
+        cpu = capacity_df['cost_per_unit'].to_numpy()
+        n_high_cost = int((cpu > totals.at['mean', 'cost_per_unit']).sum())
+        if n_high_cost > 0:
             alerts.append({
                 'type': 'warning',
                 'title': 'خدمات ذات تكلفة وحدة عالية',
-                'message': f'يوجد {len(high_cost_services)} خدمات تكلفة وحدتها أعلى من المتوسط'
+                'message': f'يوجد {n_high_cost} خدمات تكلفة وحدتها أعلى من المتوسط'
             })
             recommendations.append({
                 'title': 'تحسين الكفاءة',
@@ -416,16 +622,16 @@ class AdvancedDashboard:
             })
         
         # تحليل الطاقة المنخفضة
-        low_capacity_services = capacity_df[capacity_df['monthly_capacity'] < 100]
-        if len(low_capacity_services) > 0:
+        n_low_capacity = int((capacity_df['monthly_capacity'].to_numpy() < 100).sum())
+        if n_low_capacity > 0:
             alerts.append({
                 'type': 'info',
                 'title': 'خدمات ذات طاقة منخفضة',
-                'message': f'يوجد {len(low_capacity_services)} خدمات بطاقة شهرية أقل من 100 وحدة'
+                'message': f'يوجد {n_low_capacity} خدمات بطاقة شهرية أقل من 100 وحدة'
             })
         
         # تحليل التكاليف الإجمالية
-        total_cost = capacity_df['monthly_cost'].sum()
+        total_cost = totals.at['sum', 'monthly_cost']
         if total_cost > 150000:
             alerts.append({
                 'type': 'warning',
@@ -455,87 +661,40 @@ class AdvancedDashboard:
         if not alerts and not recommendations:
             st.success("✅ لا توجد إنذارات أو تحذيرات في الوقت الحالي")
     
-    def _show_quick_reports(self, capacity_df, pricing_df):
+    @fragment
+    def _show_quick_reports(self, capacity_df, pricing_df, totals):
         """التقارير السريعة"""
         st.markdown("### 📄 التقارير السريعة")
         
         report_type = st.selectbox(
             "اختر نوع التقرير",
-            ["تقرير شامل", "تقرير التكاليف", "تقرير الطاقة", "تقرير الأسعار"]
+            list(_REPORT_FILES.keys())
         )
         
-        from io import BytesIO
-        
+        # الصيغ البديلة أسرع وأصغر حجماً للأرشفة والتحليل الخارجي
+        report_format = "Excel"
         if report_type == "تقرير شامل":
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                capacity_df.to_excel(writer, sheet_name='الطاقة الاستيعابية', index=False)
-                pricing_df.to_excel(writer, sheet_name='شرائح الأسعار', index=False)
-                
-                # تقرير ملخص
-                summary = pd.DataFrame({
-                    'المؤشر': [
-                        'إجمالي الطاقة الشهرية',
-                        'إجمالي التكاليف الشهرية',
-                        'عدد الخدمات',
-                        'متوسط تكلفة الوحدة'
-                    ],
-                    'القيمة': [
-                        f"{capacity_df['monthly_capacity'].sum():,.0f}",
-                        f"{capacity_df['monthly_cost'].sum():,.2f} ر.س",
-                        len(capacity_df),
-                        f"{capacity_df['cost_per_unit'].mean():,.2f} ر.س"
-                    ]
-                })
-                summary.to_excel(writer, sheet_name='الملخص التنفيذي', index=False)
-            buffer.seek(0)
-            
-            st.download_button(
-                label="📥 تحميل التقرير الشامل",
-                data=buffer,
-                file_name="comprehensive_report.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                type="primary"
-            )
-        
-        elif report_type == "تقرير التكاليف":
-            cost_report = capacity_df[['service_name', 'service_group', 'monthly_cost', 'cost_per_unit']].copy()
-            buffer = BytesIO()
-            cost_report.to_excel(buffer, index=False, engine='openpyxl')
-            buffer.seek(0)
-            
-            st.download_button(
-                label="📥 تحميل تقرير التكاليف",
-                data=buffer,
-                file_name="cost_report.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                type="primary"
-            )
-        
-        elif report_type == "تقرير الطاقة":
-            capacity_report = capacity_df[['service_name', 'capacity_type', 'daily_capacity', 'monthly_capacity']].copy()
-            buffer = BytesIO()
-            capacity_report.to_excel(buffer, index=False, engine='openpyxl')
-            buffer.seek(0)
-            
-            st.download_button(
-                label="📥 تحميل تقرير الطاقة",
-                data=buffer,
-                file_name="capacity_report.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                type="primary"
-            )
-        
-        elif report_type == "تقرير الأسعار":
-            buffer = BytesIO()
-            pricing_df.to_excel(buffer, index=False, engine='openpyxl')
-            buffer.seek(0)
+            report_format = st.radio("الصيغة", ["Excel", "Parquet", "CSV.zst"], horizontal=True)
+        
+        # لا يتم بناء ملف التقرير إلا عند طلب المستخدم
+        if st.button("⚙️ تجهيز التقرير", key="prepare_report"):
+            st.session_state.prepared_report = (report_type, report_format)
+        
+        if st.session_state.get('prepared_report') == (report_type, report_format):
+            label, file_name = _REPORT_FILES[report_type]
+            if report_format == "Excel":
+                data = _build_excel(report_type, capacity_df, pricing_df, totals)
+                mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            else:
+                data = _build_archive(report_format, capacity_df, pricing_df, totals)
+                file_name = f"comprehensive_report_{report_format.split('.')[0].lower()}.zip"
+                mime = "application/zip"
             
             st.download_button(
-                label="📥 تحميل تقرير الأسعار",
-                data=buffer,
-                file_name="pricing_report.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                label=label,
+                data=data,
+                file_name=file_name,
+                mime=mime,
                 type="primary"
             )
         
@@ -4,72 +4,248 @@
 """
 
 import json
+import math
 import numpy as np
 from datetime import datetime, timedelta
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from types import MappingProxyType
+import sys
+import time
 import warnings
 warnings.filterwarnings('ignore')
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_safe(obj):
+    """تحويل التقرير إلى أنواع JSON القياسية (القيم غير المنتهية تصبح null كما في orjson)"""
+    if isinstance(obj, dict):
+        return {key: _json_safe(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_json_safe(value) for value in obj]
+    if isinstance(obj, np.ndarray):
+        return _json_safe(obj.tolist())
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    return obj
+
+
+def _dumps(obj):
+    """تسلسل التقرير إلى JSON (orjson إن توفر، وإلا json القياسية بنفس المخرجات)"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(_json_safe(obj), ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+
+@dataclass(slots=True)
+class CostData:
+    """بيانات التكاليف المفصلة والتكاليف المحسوبة للوحدة"""
+    # التكاليف المباشرة
+    direct_materials: float = 0.0
+    direct_labor: float = 0.0
+    variable_overhead: float = 0.0
+    
+    # التكاليف غير المباشرة
+    fixed_overhead: float = 0.0
+    rnd_costs: float = 0.0
+    marketing_costs: float = 0.0
+    administrative_costs: float = 0.0
+    
+    # بيانات الإنتاج
+    expected_units: float = 0.0
+    capacity_units: float = 0.0
+    production_cycle_days: float = 30
+    
+    # القيم المحسوبة
+    variable_cost_per_unit: float = 0.0
+    total_fixed_costs: float = 0.0
+    fixed_cost_per_unit: float = 0.0
+    total_cost_per_unit: float = 0.0
+    
+    def to_dict(self):
+        """تحويل البيانات إلى قاموس لاستخدامها في التقارير"""
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class Scenario:
+    """سيناريو تسعير محفوظ مع افتراضاته ونتيجة تحليله"""
+    assumptions: dict
+    created_at: float
+    analysis: dict
+
+
+@lru_cache(maxsize=1)
+def _fmt_ts(sec):
+    """تنسيق الطابع الزمني (يُعاد استخدامه طوال الثانية نفسها)"""
+    return datetime.fromtimestamp(sec).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _cost_totals(direct_materials, direct_labor, variable_overhead,
+                 fixed_overhead, rnd_costs, marketing_costs, administrative_costs, expected_units):
+    """حساب التكلفة المتغيرة والثابتة والكلية للوحدة"""
+    # التكاليف المتغيرة للوحدة
+    variable_cost_per_unit = direct_materials + direct_labor + variable_overhead
+    
+    # التكاليف الثابتة الإجمالية
+    total_fixed_costs = fixed_overhead + rnd_costs + marketing_costs + administrative_costs
+    
+    # التكاليف الثابتة للوحدة
+    fixed_cost_per_unit = total_fixed_costs / expected_units if expected_units > 0 else 0.0
+    
+    # التكلفة الكلية للوحدة
+    return variable_cost_per_unit, total_fixed_costs, fixed_cost_per_unit, variable_cost_per_unit + fixed_cost_per_unit
+
+
+# أقسام التقرير الشامل الافتراضية
+_REPORT_SECTIONS = frozenset({'lifecycle', 'psychological', 'discount', 'scenarios', 'competitors'})
+
+
+# نسب تغير السعر المستخدمة في تحليل الحساسية ومفاتيحها الثابتة
+_SENSITIVITY_CHANGES = np.array([-0.1, -0.05, 0.05, 0.1])
+_SENS_KEYS = tuple(sys.intern(k) for k in ('-10%', '-5%', '+5%', '+10%'))
+
+
+def _scenario_kernel(base_price, volume, variable_cost, fixed_costs, elasticity, changes,
+                     new_volume, new_profit, profit_change):
+    """النواة العددية لتحليل السيناريو: الإيراد والتكلفة والربح ونقطة التعادل"""
+    # نتائج الحساسية تُكتب في المخازن الممررة بدلاً من إنشاء مصفوفات جديدة
+    revenue = base_price * volume
+    total_cost = variable_cost * volume + fixed_costs
+    profit = revenue - total_cost
+    
+    np.multiply(changes, elasticity, new_volume)
+    new_volume += 1.0
+    new_volume *= volume
+    
+    np.add(changes, 1.0, new_profit)
+    new_profit *= base_price
+    new_profit *= new_volume
+    new_profit -= total_cost
+    
+    if profit != 0:
+        np.subtract(new_profit, profit, profit_change)
+        profit_change *= 100.0 / profit
+    else:
+        profit_change[:] = 0.0
+    
+    margin = base_price - variable_cost
+    break_even = fixed_costs / margin if margin > 0 else np.inf
+    return revenue, total_cost, profit, break_even
+
+
 class AdvancedPricingModel:
+    __slots__ = (
+        'product_name', 'cost_data', 'market_data', 'pricing_history',
+        '_comp_arr', '_comp_n', 'scenarios', '_version', '_report_cache',
+        '_sens_nv', '_sens_np', '_sens_pct'
+    )
+    
+    # جداول الاستراتيجيات ثابتة، لذا تُعرّف مرة واحدة على مستوى الصنف
+    _LIFECYCLE_STRATEGIES = MappingProxyType({
+        'introduction': {
+            'description': 'مرحلة التقديم - استراتيجية القشط',
+            'markup_range': (0.4, 0.6),
+            'focus': 'استرداد تكاليف R&D'
+        },
+        'growth': {
+            'description': 'مرحلة النمو - استراتيجية الاختراق', 
+            'markup_range': (0.2, 0.35),
+            'focus': 'كسب حصة سوقية'
+        },
+        'maturity': {
+            'description': 'مرحلة النضج - المنافسة على السعر',
+            'markup_range': (0.15, 0.25),
+            'focus': 'الحفاظ على الحصة السوقية'
+        },
+        'decline': {
+            'description': 'مرحلة الانحدار - تقليل الخسائر',
+            'markup_range': (0.05, 0.15),
+            'focus': 'تعظيم التدفق النقدي'
+        }
+    })
+    
+    _DISCOUNT_STRATEGIES = MappingProxyType({
+        'quantity_discounts': {
+            'tier_1': {'min_quantity': 10, 'discount': 0.05},
+            'tier_2': {'min_quantity': 50, 'discount': 0.10},
+            'tier_3': {'min_quantity': 100, 'discount': 0.15}
+        },
+        'seasonal_discount': {
+            'off_peak': {'discount': 0.10, 'season': 'منخفض'},
+            'clearance': {'discount': 0.20, 'season': 'نهاية الموسم'}
+        }
+    })
+    
+    # شرائح الخصم مسطحة بنفس ترتيب الجدول لحساب جميع الأسعار دفعة واحدة
+    _DISCOUNT_META = tuple(
+        (discount_type, strategy_name, strategy)
+        for discount_type, strategies in _DISCOUNT_STRATEGIES.items()
+        for strategy_name, strategy in strategies.items()
+        if 'discount' in strategy
+    )
+    _DISCOUNT_RATES = np.array([strategy['discount'] for _, _, strategy in _DISCOUNT_META])
+    
+    # بيانات المنافسين مخزنة كمصفوفة مهيكلة تتضاعف سعتها عند الامتلاء
+    # (الاسم كائن Python حتى لا تُقص الأسماء الطويلة)
+    _COMPETITOR_DTYPE = np.dtype([
+        ('name', 'O'), ('price', 'f8'), ('market_share', 'f8'), ('cost_structure', 'O')
+    ])
+    
     def __init__(self, product_name="منتج"):
         self.product_name = product_name
-        self.cost_data = {}
+        self.cost_data = None
         self.market_data = {}
         self.pricing_history = []
-        self.competitor_data = []
+        self._comp_arr = np.empty(8, dtype=self._COMPETITOR_DTYPE)
+        self._comp_n = 0
         self.scenarios = {}
+        self._version = 0
+        self._report_cache = (None, None, None)
+        
+        # مخازن مؤقتة لتحليل الحساسية يعاد استخدامها في كل سيناريو
+        self._sens_nv = np.empty(len(_SENSITIVITY_CHANGES))
+        self._sens_np = np.empty(len(_SENSITIVITY_CHANGES))
+        self._sens_pct = np.empty(len(_SENSITIVITY_CHANGES))
         
     def input_detailed_cost_data(self, cost_structure):
         """إدخال بيانات تكاليف مفصلة"""
-        self.cost_data = {
+        self.cost_data = CostData(
             # التكاليف المباشرة
-            'direct_materials': cost_structure.get('direct_materials', 0),
-            'direct_labor': cost_structure.get('direct_labor', 0),
-            'variable_overhead': cost_structure.get('variable_overhead', 0),
+            direct_materials=cost_structure.get('direct_materials', 0),
+            direct_labor=cost_structure.get('direct_labor', 0),
+            variable_overhead=cost_structure.get('variable_overhead', 0),
             
             # التكاليف غير المباشرة
-            'fixed_overhead': cost_structure.get('fixed_overhead', 0),
-            'rnd_costs': cost_structure.get('rnd_costs', 0),
-            'marketing_costs': cost_structure.get('marketing_costs', 0),
-            'administrative_costs': cost_structure.get('administrative_costs', 0),
+            fixed_overhead=cost_structure.get('fixed_overhead', 0),
+            rnd_costs=cost_structure.get('rnd_costs', 0),
+            marketing_costs=cost_structure.get('marketing_costs', 0),
+            administrative_costs=cost_structure.get('administrative_costs', 0),
             
             # بيانات الإنتاج
-            'expected_units': cost_structure.get('expected_units', 0),
-            'capacity_units': cost_structure.get('capacity_units', 0),
-            'production_cycle_days': cost_structure.get('production_cycle_days', 30)
-        }
+            expected_units=cost_structure.get('expected_units', 0),
+            capacity_units=cost_structure.get('capacity_units', 0),
+            production_cycle_days=cost_structure.get('production_cycle_days', 30)
+        )
         
         # حساب التكاليف الإجمالية
         self._calculate_total_costs()
+        self._version += 1
     
     def _calculate_total_costs(self):
         """حساب التكاليف الإجمالية"""
-        # التكاليف المتغيرة للوحدة
-        self.cost_data['variable_cost_per_unit'] = (
-            self.cost_data['direct_materials'] + 
-            self.cost_data['direct_labor'] + 
-            self.cost_data['variable_overhead']
-        )
-        
-        # التكاليف الثابتة الإجمالية
-        self.cost_data['total_fixed_costs'] = (
-            self.cost_data['fixed_overhead'] +
-            self.cost_data['rnd_costs'] +
-            self.cost_data['marketing_costs'] +
-            self.cost_data['administrative_costs']
-        )
-        
-        # التكاليف الثابتة للوحدة
-        if self.cost_data['expected_units'] > 0:
-            self.cost_data['fixed_cost_per_unit'] = (
-                self.cost_data['total_fixed_costs'] / self.cost_data['expected_units']
-            )
-        else:
-            self.cost_data['fixed_cost_per_unit'] = 0
-        
-        # التكلفة الكلية للوحدة
-        self.cost_data['total_cost_per_unit'] = (
-            self.cost_data['variable_cost_per_unit'] + 
-            self.cost_data['fixed_cost_per_unit']
+        c = self.cost_data
+        (c.variable_cost_per_unit, c.total_fixed_costs,
+         c.fixed_cost_per_unit, c.total_cost_per_unit) = _cost_totals(
+            float(c.direct_materials), float(c.direct_labor), float(c.variable_overhead),
+            float(c.fixed_overhead), float(c.rnd_costs), float(c.marketing_costs),
+            float(c.administrative_costs), float(c.expected_units)
         )
     
     def input_market_analysis(self, market_analysis):
@@ -83,53 +259,41 @@ class AdvancedPricingModel:
             'seasonality_factor': market_analysis.get('seasonality_factor', 1.0),
             'product_lifecycle_stage': market_analysis.get('product_lifecycle_stage', 'growth')
         }
+        self._version += 1
     
     def add_competitor(self, name, price, market_share, cost_structure=None):
         """إضافة بيانات منافس"""
-        competitor = {
-            'name': name,
-            'price': price,
-            'market_share': market_share,
-            'cost_structure': cost_structure or {}
-        }
-        self.competitor_data.append(competitor)
+        if self._comp_n == len(self._comp_arr):
+            self._comp_arr = np.resize(self._comp_arr, 2 * self._comp_n)
+        self._comp_arr[self._comp_n] = (name, price, market_share, cost_structure or {})
+        self._comp_n += 1
+        self._version += 1
+    
+    @property
+    def competitor_data(self):
+        """بيانات المنافسين المضافة (عرض على المصفوفة المهيكلة)"""
+        return self._comp_arr[:self._comp_n]
+    
+    def competitor_price_stats(self):
+        """أقل ومتوسط وأعلى سعر للمنافسين"""
+        if not self._comp_n:
+            return {}
+        prices = self.competitor_data['price']
+        return {'min': float(prices.min()), 'mean': float(prices.mean()), 'max': float(prices.max())}
     
     def calculate_lifecycle_pricing(self):
         """تسعير بناءً على مرحلة دورة حياة المنتج"""
         lifecycle_stage = self.market_data.get('product_lifecycle_stage', 'growth')
-        base_cost = self.cost_data.get('total_cost_per_unit', 0)
-        
-        lifecycle_strategies = {
-            'introduction': {
-                'description': 'مرحلة التقديم - استراتيجية القشط',
-                'markup_range': (0.4, 0.6),
-                'focus': 'استرداد تكاليف R&D'
-            },
-            'growth': {
-                'description': 'مرحلة النمو - استراتيجية الاختراق', 
-                'markup_range': (0.2, 0.35),
-                'focus': 'كسب حصة سوقية'
-            },
-            'maturity': {
-                'description': 'مرحلة النضج - المنافسة على السعر',
-                'markup_range': (0.15, 0.25),
-                'focus': 'الحفاظ على الحصة السوقية'
-            },
-            'decline': {
-                'description': 'مرحلة الانحدار - تقليل الخسائر',
-                'markup_range': (0.05, 0.15),
-                'focus': 'تعظيم التدفق النقدي'
-            }
-        }
-        
-        strategy = lifecycle_strategies.get(lifecycle_stage, lifecycle_strategies['growth'])
+        base_cost = (self.cost_data or CostData()).total_cost_per_unit
+        strategies = self._LIFECYCLE_STRATEGIES
+        strategy = strategies.get(lifecycle_stage, strategies['growth'])
         min_markup, max_markup = strategy['markup_range']
         
         return {
             'stage': lifecycle_stage,
             'strategy': strategy['description'],
             'focus': strategy['focus'],
-            'recommended_markup_range': f"{min_markup*100}% - {max_markup*100}%",
+            'recommended_markup_range': (min_markup, max_markup),
             'price_range': {
                 'min': base_cost * (1 + min_markup),
                 'max': base_cost * (1 + max_markup)
@@ -142,7 +306,7 @@ class AdvancedPricingModel:
         
         psychological_prices['ending_999'] = {
             'description': 'تنتهي بـ 9.99 (تأثير اليسار)',
-            'price': round(base_price - 0.01, 2),
+            'price': base_price - 0.01,
             'perceived_value': 'جيد للسلع الاستهلاكية'
         }
         
@@ -155,7 +319,7 @@ class AdvancedPricingModel:
         if base_price > 10:
             psychological_prices['charm_pricing'] = {
                 'description': 'تسعير جذاب',
-                'price': round(base_price - 0.01, 2),
+                'price': base_price - 0.01,
                 'perceived_value': 'يخلق وهم الدفع الأقل'
             }
         
@@ -163,99 +327,115 @@ class AdvancedPricingModel:
     
     def calculate_discount_strategy(self, base_price):
         """استراتيجية الخصومات"""
-        discount_strategies = {
-            'quantity_discounts': {
-                'tier_1': {'min_quantity': 10, 'discount': 0.05},
-                'tier_2': {'min_quantity': 50, 'discount': 0.10},
-                'tier_3': {'min_quantity': 100, 'discount': 0.15}
-            },
-            'seasonal_discount': {
-                'off_peak': {'discount': 0.10, 'season': 'منخفض'},
-                'clearance': {'discount': 0.20, 'season': 'نهاية الموسم'}
-            }
-        }
+        prices = base_price * (1.0 - self._DISCOUNT_RATES)
         
-        discounted_prices = {}
-        for discount_type, strategies in discount_strategies.items():
-            discounted_prices[discount_type] = {}
-            for strategy_name, strategy in strategies.items():
-                if 'discount' in strategy:
-                    discounted_price = base_price * (1 - strategy['discount'])
-                    discounted_prices[discount_type][strategy_name] = {
-                        'original_price': base_price,
-                        'discounted_price': round(discounted_price, 2),
-                        'discount_percentage': strategy['discount'] * 100,
-                        'conditions': strategy
-                    }
+        discounted_prices = {discount_type: {} for discount_type in self._DISCOUNT_STRATEGIES}
+        for (discount_type, strategy_name, strategy), price in zip(self._DISCOUNT_META, prices):
+            discounted_prices[discount_type][strategy_name] = {
+                'original_price': base_price,
+                'discounted_price': float(price),
+                'discount_percentage': strategy['discount'] * 100,
+                'conditions': dict(strategy)
+            }
         
         return discounted_prices
     
     def create_pricing_scenario(self, scenario_name, assumptions):
         """إنشاء سيناريوهات تسعير مختلفة"""
-        self.scenarios[scenario_name] = {
-            'assumptions': assumptions,
-            'created_at': datetime.now(),
-            'analysis': self._analyze_scenario(assumptions)
-        }
+        self.scenarios[scenario_name] = Scenario(
+            assumptions, time.time(), self._analyze_scenario(assumptions)
+        )
+        self._version += 1
         
         return self.scenarios[scenario_name]
     
     def _analyze_scenario(self, assumptions):
         """تحليل السيناريو"""
-        base_price = assumptions.get('base_price', self.cost_data.get('total_cost_per_unit', 0) * 1.3)
-        volume = assumptions.get('volume', self.cost_data.get('expected_units', 0))
+        cd = self.cost_data or CostData()
+        vcpu = cd.variable_cost_per_unit
+        tfc = cd.total_fixed_costs
+        elasticity = self.market_data.get('price_elasticity', -1.5)
+        changes = _SENSITIVITY_CHANGES
         
-        revenue = base_price * volume
-        total_cost = (self.cost_data.get('variable_cost_per_unit', 0) * volume + 
-                     self.cost_data.get('total_fixed_costs', 0))
-        profit = revenue - total_cost
+        base_price = assumptions.get('base_price', cd.total_cost_per_unit * 1.3)
+        volume = assumptions.get('volume', cd.expected_units)
         
         # تحليل الحساسية
         sensitivity = {}
-        price_elasticity = self.market_data.get('price_elasticity', -1.5)
         
-        for change in [-0.1, -0.05, 0.05, 0.1]:
-            new_volume = volume * (1 + change * price_elasticity)
-            new_revenue = base_price * (1 + change) * new_volume
-            new_profit = new_revenue - total_cost
-            sensitivity[f"{change*100:+.0f}%"] = {
-                'new_profit': round(new_profit, 2),
-                'profit_change_percentage': round(((new_profit - profit) / profit) * 100, 2) if profit != 0 else 0
-            }
+        new_profit = self._sens_np
+        profit_change = self._sens_pct
+        revenue, total_cost, profit, break_even = _scenario_kernel(
+            float(base_price), float(volume), float(vcpu), float(tfc), float(elasticity), changes,
+            self._sens_nv, new_profit, profit_change
+        )
         
-        variable_cost = self.cost_data.get('variable_cost_per_unit', 0)
-        break_even = self.cost_data.get('total_fixed_costs', 0) / (base_price - variable_cost) if (base_price - variable_cost) > 0 else float('inf')
+        for key, p, q in zip(_SENS_KEYS, new_profit, profit_change):
+            sensitivity[key] = {
+                'new_profit': float(p),
+                'profit_change_percentage': float(q)
+            }
         
         return {
             'base_price': base_price,
             'expected_volume': volume,
-            'revenue': round(revenue, 2),
-            'total_cost': round(total_cost, 2),
-            'profit': round(profit, 2),
-            'profit_margin': round((profit / revenue) * 100, 2) if revenue > 0 else 0,
+            'revenue': revenue,
+            'total_cost': total_cost,
+            'profit': profit,
+            'profit_margin': (profit / revenue) * 100 if revenue > 0 else 0,
             'sensitivity_analysis': sensitivity,
             'break_even_point': break_even
         }
     
-    def generate_comprehensive_report(self):
-        """توليد تقرير شامل"""
+    def generate_comprehensive_report(self, sections=None):
+        """توليد تقرير شامل (يمكن تحديد الأقسام المطلوبة فقط عبر sections)"""
         if not self.cost_data or not self.market_data:
             return {"error": "بيانات غير كاملة. يرجى إدخال بيانات التكاليف والسوق أولاً."}
         
-        base_price = self.cost_data.get('total_cost_per_unit', 0) * 1.3
+        sections = frozenset(sections or _REPORT_SECTIONS)
+        
+        # إعادة التقرير المخزن إذا لم تتغير البيانات ولا الأقسام منذ آخر توليد
+        # (نسخة سطحية بطابع زمني حديث حتى لا يعدّل المستدعي النسخة المخزنة)
+        cached_version, cached_sections, cached_report = self._report_cache
+        if cached_version == self._version and cached_sections == sections:
+            return dict(cached_report, timestamp=_fmt_ts(int(time.time())))
+        
+        cd = self.cost_data
+        base_price = cd.total_cost_per_unit * 1.3
         
         report = {
             'product_name': self.product_name,
-            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'cost_analysis': self.cost_data,
-            'market_analysis': self.market_data,
-            'lifecycle_pricing': self.calculate_lifecycle_pricing(),
-            'competitor_analysis': self.competitor_data,
-            'scenarios': self.scenarios,
-            'recommendations': {
-                'psychological_pricing': self.calculate_psychological_pricing(base_price),
-                'discount_strategies': self.calculate_discount_strategy(base_price)
-            }
+            'timestamp': _fmt_ts(int(time.time())),
+            'cost_analysis': cd.to_dict(),
+            'market_analysis': self.market_data
         }
+        if 'lifecycle' in sections:
+            report['lifecycle_pricing'] = self.calculate_lifecycle_pricing()
+        if 'competitors' in sections:
+            report['competitor_analysis'] = [
+                dict(zip(self._COMPETITOR_DTYPE.names, row)) for row in self.competitor_data.tolist()
+            ]
+        if 'scenarios' in sections:
+            report['scenarios'] = {
+                name: {
+                    'assumptions': scenario.assumptions,
+                    'created_at': _fmt_ts(int(scenario.created_at)),
+                    'analysis': scenario.analysis
+                }
+                for name, scenario in self.scenarios.items()
+            }
         
-        return report
+        recommendations = {}
+        if 'psychological' in sections:
+            recommendations['psychological_pricing'] = self.calculate_psychological_pricing(base_price)
+        if 'discount' in sections:
+            recommendations['discount_strategies'] = self.calculate_discount_strategy(base_price)
+        if recommendations:
+            report['recommendations'] = recommendations
+        
+        self._report_cache = (self._version, sections, report)
+        return dict(report)
+    
+    def generate_comprehensive_report_json(self, sections=None):
+        """توليد التقرير الشامل بصيغة JSON"""
+        return _dumps(self.generate_comprehensive_report(sections))
@@ -1,29 +1,51 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import datetime
 import numpy as np
 from pathlib import Path
+from importlib.util import find_spec
 import warnings
-from cma_pricing_model import CMAPricingModel
-from advanced_pricing_model import AdvancedPricingModel
-from enterprise_pricing_model import EnterprisePricingModel, PricingRecommendationEngine, create_sample_sales_data
-from predictive_pricing_ai import PredictivePricingAI
-from comprehensive_pricing_system import (
-    ComprehensivePricingEcosystem,
-    QualityComplianceSystem,
-    CrisisManagementSystem,
-    AdaptiveLearningSystem,
-    SupplierRelationshipManagement,
-    SustainabilityPricingSystem,
-    KnowledgeManagementSystem,
-    PricingAutomationSystem
-)
-from smart_pricing_engine import SmartPricingEngine, AdvancedPricingEngine
-from order_data_processor import OrderDataProcessor, PricingOptimizer, get_memory_usage, get_data_summary
 warnings.filterwarnings('ignore')
 
+# محركات Excel تُفحص هنا دون استيرادها، ولا يحمّلها pandas إلا عند أول قراءة أو كتابة فعلية
+
+# محرك calamine أسرع في قراءة ملفات Excel (xlsx و xls)، وإذا لم يكن مثبتاً يختار pandas المحرك حسب نوع الملف
+EXCEL_READ_ENGINE = "calamine" if find_spec("python_calamine") else None
+
+# xlsxwriter أسرع وأقل استهلاكاً للذاكرة في كتابة ملفات Excel
+if find_spec("xlsxwriter"):
+    EXCEL_WRITE_ENGINE = "xlsxwriter"
+    # كتابة النصوص كما هي دون فحص كل نص بحثاً عن روابط أو معادلات
+    EXCEL_WRITE_KWARGS = {"options": {"strings_to_urls": False, "strings_to_formulas": False}}
+else:
+    EXCEL_WRITE_ENGINE = "openpyxl"
+    EXCEL_WRITE_KWARGS = None
+
+# st.fragment (أو اسمه التجريبي في الإصدارات الأقدم) يعيد تشغيل جزء من الصفحة فقط عند التفاعل معه
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+# ثوابت قوائم الاختيار والرسوم تُنشأ مرة واحدة عند تحميل الوحدة بدلاً من كل إعادة تشغيل
+_LIFECYCLE_STAGES = ("introduction", "growth", "maturity", "decline")
+_LIFECYCLE_LABELS = {
+    "introduction": "🌱 تقديم",
+    "growth": "📈 نمو",
+    "maturity": "⚖️ نضج",
+    "decline": "📉 انحدار"
+}
+_MARKET_CONDITIONS = ("stable", "competitive", "penetration", "premium")
+_URGENCY_LEVELS = ('low', 'normal', 'high', 'urgent')
+_URGENCY_LABELS = {
+    'low': 'منخفض',
+    'normal': 'عادي',
+    'high': 'عالي',
+    'urgent': 'طارئ'
+}
+
+# فئات المخاطر بترتيب الرسم البياني مع تسمياتها وألوانها
+_RISK_CATEGORIES = ('competitive_risks', 'demand_risks', 'regulatory_risks', 'supply_chain_risks')
+_RISK_LABELS = ('تنافسية', 'الطلب', 'تنظيمية', 'سلسلة التوريد')
+_RISK_COLORS = ('#ff6b6b', '#ffd93d', '#6bcf7f', '#4d96ff')
+
 # إعداد الصفحة
 st.set_page_config(
     page_title="نظام متالي للتسعير الذكي",
@@ -72,7 +94,92 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_data(show_spinner=False)
+def read_parquet_cached(path, mtime, _normalize=None):
+    """قراءة ملف Parquet (وتهيئته اختيارياً) مع التخزين المؤقت حسب وقت آخر تعديل للملف"""
+    df = pd.read_parquet(path, engine="pyarrow")
+    return _normalize(df) if _normalize is not None else df
+
+def write_parquet(df, path):
+    """حفظ جدول بصيغة Parquet مضغوطة (الأعمدة النصية المختلطة تُحفظ كنصوص)"""
+    object_cols = df.columns[df.dtypes == object]
+    if len(object_cols):
+        df = df.astype({col: "string" for col in object_cols})
+    df.to_parquet(path, engine="pyarrow", compression="zstd", index=False)
+
+@st.cache_data(show_spinner=False)
+def read_csv_cached(path, mtime, parse_dates=None):
+    """قراءة ملف CSV مع التخزين المؤقت حسب وقت آخر تعديل للملف"""
+    return pd.read_csv(path, parse_dates=parse_dates)
+
+@st.cache_data(show_spinner=False)
+def excel_bytes_cached(_df, source, mtime, sheet_name="Sheet1"):
+    """تحويل جدول إلى ملف Excel في الذاكرة (يُعاد بناؤه فقط عند تغير الملف المصدر)"""
+    from io import BytesIO
+    buffer = BytesIO()
+    _df.to_excel(
+        buffer, sheet_name=sheet_name, index=False, engine=EXCEL_WRITE_ENGINE, engine_kwargs=EXCEL_WRITE_KWARGS
+    )
+    return buffer.getvalue()
+
+@st.cache_data(show_spinner=False)
+def csv_bytes_cached(_df, source, mtime):
+    """تحويل جدول إلى ملف CSV (UTF-8 مع BOM ليفتح بشكل صحيح في Excel)"""
+    return _df.to_csv(index=False).encode('utf-8-sig')
+
+def read_uploaded_table(uploaded_file, nrows=None):
+    """قراءة ملف مرفوع بصيغة CSV أو Excel (أو أول nrows صفوف منه فقط للمعاينة)"""
+    uploaded_file.seek(0)
+    if uploaded_file.name.lower().endswith('.csv'):
+        return pd.read_csv(uploaded_file, encoding='utf-8-sig', nrows=nrows)
+    return pd.read_excel(uploaded_file, engine=EXCEL_READ_ENGINE, nrows=nrows)
+
+def downcast_integers(df):
+    """تحويل الأعمدة الصحيحة من int64 إلى int32 إذا اتسعت لقيمها (الأعمدة العشرية تبقى float64 لدقة الأسعار)"""
+    # int32 وليس أصغر منه حتى تبقى مساحة كافية للقيم التي يعدلها المستخدم لاحقاً في الجداول
+    limits = np.iinfo(np.int32)
+    int_cols = [
+        col for col in df.select_dtypes('int64').columns
+        if df[col].between(limits.min, limits.max).all()
+    ]
+    if int_cols:
+        df[int_cols] = df[int_cols].astype(np.int32)
+    return df
+
+@st.cache_data(show_spinner=False)
+def build_tier_tables(_pricing_df, path, mtime):
+    """بناء جداول الشرائح لكل خدمة بترتيبها في ملف الأسعار (مرة واحدة لكل نسخة من الملف)"""
+    codes, keys = pd.factorize(_pricing_df['service_key'])
+    min_volumes = _pricing_df['min_volume'].to_numpy(dtype=float)
+    max_volumes = _pricing_df['max_volume'].to_numpy(dtype=float)
+    unit_prices = _pricing_df['unit_price'].to_numpy(dtype=float)
+
+    order = np.argsort(codes, kind='stable')
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+
+    return {
+        keys[codes[group[0]]]: (min_volumes[group], max_volumes[group], unit_prices[group])
+        for group in np.split(order, bounds) if len(group) and codes[group[0]] >= 0
+    }
+
+def file_mtime(path):
+    """وقت آخر تعديل للملف (0 إذا لم يكن موجوداً)"""
+    return path.stat().st_mtime_ns if path.exists() else 0
+
 class MataliPricingSystem:
+    # القيم المعروفة لأعمدة الفئات (تُضاف إليها أي قيم أخرى موجودة في البيانات)
+    SERVICE_GROUPS = ["Receiving", "Storage", "Fulfillment", "Shipping", "Value Added"]
+    CAPACITY_TYPES = ["daily", "static"]
+    
+    # الأعمدة المطلوبة في ملفات الرفع (الأعمدة المحسوبة تُضاف تلقائياً عند الحفظ)
+    CAPACITY_UPLOAD_COLUMNS = frozenset([
+        "service_key", "service_group", "service_name", "unit_name", "capacity_type",
+        "daily_capacity", "static_capacity", "working_days", "monthly_cost"
+    ])
+    CAPACITY_NUMERIC_COLUMNS = ("daily_capacity", "static_capacity", "working_days", "monthly_cost")
+    PRICING_UPLOAD_COLUMNS = frozenset(["service_key", "tier_name", "min_volume", "max_volume", "unit_price"])
+    PRICING_NUMERIC_COLUMNS = ("min_volume", "max_volume", "unit_price")
+    
     def __init__(self):
         self.data_dir = Path("data")
         self.data_dir.mkdir(exist_ok=True)
@@ -81,9 +188,14 @@ class MataliPricingSystem:
     
     def setup_file_paths(self):
         """إعداد مسارات الملفات"""
-        self.capacity_file = self.data_dir / "capacity_config.xlsx"
-        self.pricing_file = self.data_dir / "pricing_tiers.xlsx"
-        self.quotes_file = self.data_dir / "quotes_history.xlsx"
+        # بيانات الطاقة والأسعار تُخزن بصيغة Parquet، وExcel يبقى للاستيراد والتصدير فقط
+        self.capacity_file = self.data_dir / "capacity_config.parquet"
+        self.legacy_capacity_file = self.data_dir / "capacity_config.xlsx"
+        self.pricing_file = self.data_dir / "pricing_tiers.parquet"
+        self.legacy_pricing_file = self.data_dir / "pricing_tiers.xlsx"
+        # سجل العروض يُحفظ كملف CSV يُضاف إليه سطر لكل عرض دون إعادة كتابة الملف
+        self.quotes_file = self.data_dir / "quotes_history.csv"
+        self.legacy_quotes_file = self.data_dir / "quotes_history.xlsx"
         self.services_file = self.data_dir / "service_master.xlsx"
         self.cost_alloc_file = self.data_dir / "cost_allocations.xlsx"
     
@@ -112,24 +224,36 @@ class MataliPricingSystem:
                     df[col] = 0.0
         
         # حساب الطاقة الشهرية
-        def calc_monthly_capacity(row):
-            if row['capacity_type'] == 'static':
-                return row['static_capacity']
-            else:
-                return row['daily_capacity'] * row['working_days']
-        
-        df['monthly_capacity'] = df.apply(calc_monthly_capacity, axis=1)
+        daily_capacity = df['daily_capacity'].to_numpy(dtype=float)
+        static_capacity = df['static_capacity'].to_numpy(dtype=float)
+        working_days = df['working_days'].to_numpy(dtype=float)
+        df['monthly_capacity'] = np.where(
+            df['capacity_type'].to_numpy() == 'static',
+            static_capacity,
+            daily_capacity * working_days
+        )
         
         # حساب تكلفة الوحدة
-        def calc_cost_per_unit(row):
-            if row['monthly_capacity'] > 0:
-                return row['monthly_cost'] / row['monthly_capacity']
-            return 0.0
+        monthly_capacity = df['monthly_capacity'].to_numpy()
+        monthly_cost = df['monthly_cost'].to_numpy(dtype=float)
+        df['cost_per_unit'] = np.where(
+            monthly_capacity > 0,
+            monthly_cost / np.where(monthly_capacity > 0, monthly_capacity, 1.0),
+            0.0
+        )
         
-        df['cost_per_unit'] = df.apply(calc_cost_per_unit, axis=1)
+        # أعمدة التجميع المتكررة كفئات لتقليل الذاكرة وتسريع المقارنة والتجميع
+        df['service_group'] = self.as_category(df['service_group'], self.SERVICE_GROUPS)
+        df['capacity_type'] = self.as_category(df['capacity_type'], self.CAPACITY_TYPES)
         
         return df
 
+    @staticmethod
+    def as_category(series, known_values):
+        """تحويل عمود إلى فئات تشمل القيم المعروفة وأي قيم أخرى موجودة فيه"""
+        categories = list(dict.fromkeys([*known_values, *series.dropna().unique()]))
+        return series.astype(pd.CategoricalDtype(categories))
+
     def ensure_pricing_columns(self, df):
         """ضمان أعمدة بيانات التسعير حتى في حالة غياب البيانات"""
         required_cols = {
@@ -140,81 +264,129 @@ class MataliPricingSystem:
             "unit_price": 0.0
         }
 
+        num_cols = ["min_volume", "max_volume", "unit_price"]
+        str_cols = ["service_key", "tier_name"]
+
         for col, default in required_cols.items():
             if col not in df.columns:
                 df[col] = default
-            else:
-                if col in ["min_volume", "max_volume", "unit_price"]:
-                    df[col] = pd.to_numeric(df[col], errors="coerce").fillna(default)
-                else:
-                    df[col] = df[col].fillna(default).astype(str)
+
+        # تحويل الأعمدة دفعة واحدة، مع تخطي الأعمدة الرقمية إذا كانت مهيأة مسبقاً
+        numeric = df[num_cols]
+        if not ((numeric.dtypes == "float64").all() and numeric.notna().all().all()):
+            df[num_cols] = numeric.apply(pd.to_numeric, errors="coerce").fillna(0.0)
+        df[str_cols] = df[str_cols].fillna("").astype(str)
 
         ordered_cols = list(required_cols.keys())
         extra_cols = [col for col in df.columns if col not in ordered_cols]
         return df[ordered_cols + extra_cols]
 
+    def migrate_legacy_table(self, path, legacy_path):
+        """نقل ملف بيانات قديم من Excel إلى Parquet مرة واحدة"""
+        if not path.exists() and legacy_path.exists():
+            write_parquet(pd.read_excel(legacy_path, engine=EXCEL_READ_ENGINE), path)
+
+    @staticmethod
+    def upload_errors(df, required_columns, numeric_columns):
+        """فحص أعمدة الملف المرفوع: الأعمدة الناقصة والأعمدة الرقمية التي تحتوي نصوصاً"""
+        errors = []
+        missing = required_columns - set(df.columns)
+        if missing:
+            errors.append(f"❌ أعمدة ناقصة في الملف: {', '.join(sorted(missing))}")
+        
+        # الخلايا الفارغة مقبولة (تُعتبر صفراً)، أما النصوص في الأعمدة الرقمية فمرفوضة
+        invalid = [
+            col for col in numeric_columns
+            if col in df.columns and (pd.to_numeric(df[col], errors='coerce').isna() & df[col].notna()).any()
+        ]
+        if invalid:
+            errors.append(f"❌ أعمدة رقمية تحتوي على نصوص: {', '.join(invalid)}")
+        return errors
+
     def load_capacity_data(self):
         """تحميل بيانات الطاقة"""
+        self.migrate_legacy_table(self.capacity_file, self.legacy_capacity_file)
         if self.capacity_file.exists():
-            df = pd.read_excel(self.capacity_file)
-        else:
-            df = pd.DataFrame(self.capacity_defaults)
+            # القراءة والتهيئة مخزنتان معاً، فلا تتكرر أي منهما ما لم يتغير الملف
+            return read_parquet_cached(
+                str(self.capacity_file), file_mtime(self.capacity_file), self.ensure_capacity_columns
+            )
         
-        return self.ensure_capacity_columns(df)
+        return self.ensure_capacity_columns(pd.DataFrame(self.capacity_defaults))
 
     def save_capacity_data(self, df):
         """حفظ بيانات الطاقة"""
         df = self.ensure_capacity_columns(df)
-        df.to_excel(self.capacity_file, index=False)
+        write_parquet(df, self.capacity_file)
         return df
 
     def load_pricing_data(self):
         """تحميل بيانات شرائح الأسعار"""
-        if self.pricing_file.exists():
-            df = pd.read_excel(self.pricing_file)
-        else:
+        self.migrate_legacy_table(self.pricing_file, self.legacy_pricing_file)
+        if not self.pricing_file.exists():
             df = pd.DataFrame(columns=getattr(self, "pricing_columns", []))
-            df.to_excel(self.pricing_file, index=False)
+            write_parquet(df, self.pricing_file)
 
-        return self.ensure_pricing_columns(df)
+        # القراءة والتهيئة مخزنتان معاً، فلا تتكرر أي منهما ما لم يتغير الملف
+        return read_parquet_cached(str(self.pricing_file), file_mtime(self.pricing_file), self.ensure_pricing_columns)
 
     def save_pricing_data(self, df):
         """حفظ بيانات شرائح الأسعار"""
         df = self.ensure_pricing_columns(df)
-        df.to_excel(self.pricing_file, index=False)
+        write_parquet(df, self.pricing_file)
         return df
 
-    def get_unit_price(self, service_key, volume, pricing_df):
-        """الحصول على سعر الوحدة بناءً على الشريحة"""
-        service_tiers = pricing_df[pricing_df['service_key'] == service_key]
-        
-        for _, tier in service_tiers.iterrows():
-            min_vol = tier['min_volume']
-            max_vol = tier['max_volume']
-            
-            if volume >= min_vol and (max_vol == 0 or volume <= max_vol):
-                return tier['unit_price']
-        
+    def migrate_legacy_quotes(self):
+        """نقل سجل العروض القديم من Excel إلى CSV مرة واحدة"""
+        if not self.quotes_file.exists() and self.legacy_quotes_file.exists():
+            pd.read_excel(self.legacy_quotes_file, engine=EXCEL_READ_ENGINE).to_csv(self.quotes_file, index=False)
+
+    def load_quotes_data(self):
+        """تحميل سجل العروض"""
+        self.migrate_legacy_quotes()
+        if not self.quotes_file.exists():
+            return pd.DataFrame()
+        return read_csv_cached(str(self.quotes_file), file_mtime(self.quotes_file), parse_dates=['quote_date'])
+
+    def save_quote(self, quote_data):
+        """إضافة عرض سعر إلى السجل (إلحاق سطر واحد دون قراءة السجل)"""
+        self.migrate_legacy_quotes()
+        pd.DataFrame([quote_data]).to_csv(
+            self.quotes_file, mode='a', header=not self.quotes_file.exists(), index=False
+        )
+
+    def get_unit_price(self, service_key, volume, tier_tables):
+        """الحصول على سعر الوحدة بناءً على الشريحة (من جداول build_tier_tables)"""
+        service_tiers = tier_tables.get(service_key)
+        if service_tiers is None:
+            return 0.0
+
+        # أول شريحة مطابقة بترتيب الملف هي التي تحدد السعر
+        min_volumes, max_volumes, unit_prices = service_tiers
+        matches = (volume >= min_volumes) & ((max_volumes == 0) | (volume <= max_volumes))
+        idx = matches.argmax()
+        if matches[idx]:
+            return unit_prices[idx]
+
         return 0.0
 
-    def calculate_service_pricing(self, service_data, volume, pricing_df):
-        """حساب تسعير الخدمة الواحدة"""
-        service_key = service_data['service_key']
-        monthly_capacity = service_data['monthly_capacity']
-        cost_per_unit = service_data['cost_per_unit']
-        
-        volume = float(volume) if volume else 0.0
+    def calculate_quote_pricing(self, services_df, volumes, tier_tables):
+        """حساب تسعير الخدمات المختارة دفعة واحدة"""
+        volume = np.asarray(volumes, dtype=float)
+        monthly_capacity = services_df['monthly_capacity'].to_numpy(dtype=float)
+        cost_per_unit = services_df['cost_per_unit'].to_numpy(dtype=float)
+        service_keys = services_df['service_key'].tolist()
         
         # حساب مؤشرات الطاقة
-        if monthly_capacity > 0:
-            utilization = (volume / monthly_capacity) * 100
-            waste_units = max(monthly_capacity - volume, 0)
-        else:
-            utilization = 0.0
-            waste_units = 0.0
-        
-        # الحصول على سعر الوحدة
-        unit_price = self.get_unit_price(service_key, volume, pricing_df)
+        has_capacity = monthly_capacity > 0
+        utilization = np.where(has_capacity, volume / np.where(has_capacity, monthly_capacity, 1.0) * 100, 0.0)
+        waste_units = np.where(has_capacity, np.maximum(monthly_capacity - volume, 0), 0.0)
+        
+        # الحصول على سعر الوحدة لكل خدمة
+        unit_price = np.array(
+            [self.get_unit_price(key, vol, tier_tables) for key, vol in zip(service_keys, volume)],
+            dtype=float
+        )
         
         # الحسابات المالية
         revenue = volume * unit_price
@@ -225,13 +397,13 @@ class MataliPricingSystem:
         margin_used = revenue - cost_used
         margin_total = revenue - total_cost
         
-        margin_used_pct = (margin_used / revenue * 100) if revenue > 0 else 0
-        margin_total_pct = (margin_total / revenue * 100) if revenue > 0 else 0
+        has_revenue = revenue > 0
+        safe_revenue = np.where(has_revenue, revenue, 1.0)
         
-        return {
-            'service_key': service_key,
-            'service_name': service_data['service_name'],
-            'unit_name': service_data['unit_name'],
+        return pd.DataFrame({
+            'service_key': service_keys,
+            'service_name': services_df['service_name'].tolist(),
+            'unit_name': services_df['unit_name'].tolist(),
             'volume': volume,
             'monthly_capacity': monthly_capacity,
             'utilization_pct': utilization,
@@ -243,13 +415,18 @@ class MataliPricingSystem:
             'cost_waste': cost_waste,
             'total_cost': total_cost,
             'margin_used': margin_used,
-            'margin_used_pct': margin_used_pct,
+            'margin_used_pct': np.where(has_revenue, margin_used / safe_revenue * 100, 0.0),
             'margin_total': margin_total,
-            'margin_total_pct': margin_total_pct
-        }
+            'margin_total_pct': np.where(has_revenue, margin_total / safe_revenue * 100, 0.0)
+        })
+
+# إنشاء النظام مرة واحدة ومشاركته بين إعادات التشغيل
+@st.cache_resource
+def get_pricing_system():
+    """الحصول على نسخة نظام التسعير المشتركة"""
+    return MataliPricingSystem()
 
-# إنشاء النظام
-pricing_system = MataliPricingSystem()
+pricing_system = get_pricing_system()
 
 def show_capacity_setup():
     """صفحة إعداد الطاقة الاستيعابية"""
@@ -386,8 +563,8 @@ def show_capacity_setup():
                     "cost_per_unit": 0.0
                 }
                 
-                new_df = pd.concat([capacity_df, pd.DataFrame([new_service])], ignore_index=True)
-                pricing_system.save_capacity_data(new_df)
+                capacity_df.loc[len(capacity_df)] = new_service
+                pricing_system.save_capacity_data(capacity_df)
                 st.success(f"✅ تمت إضافة الخدمة '{new_service_name}' بنجاح!")
                 st.rerun()
 
@@ -452,6 +629,10 @@ def show_pricing_tiers():
         3. أو تحميل قالب Excel من صفحة "📥 قوالب Excel" وتعبئته ثم رفعه
         """)
     
+    # قائمة مفاتيح الخدمات وأسماؤها تُحسب مرة واحدة لكل عرض للصفحة
+    service_keys = capacity_df['service_key'].tolist()
+    service_names = capacity_df.drop_duplicates('service_key').set_index('service_key')['service_name'].to_dict()
+    
     tab1, tab2 = st.tabs(["📝 تعديل الشرائح", "➕ إضافة شريحة جديدة"])
     
     with tab1:
@@ -467,7 +648,7 @@ def show_pricing_tiers():
                 column_config={
                     "service_key": st.column_config.SelectboxColumn(
                         "مفتاح الخدمة",
-                        options=capacity_df['service_key'].tolist(),
+                        options=service_keys,
                         required=True
                     ),
                     "tier_name": st.column_config.TextColumn("اسم الشريحة", required=True),
@@ -491,8 +672,8 @@ def show_pricing_tiers():
         with st.form("new_tier_form"):
             tier_service_key = st.selectbox(
                 "اختر الخدمة",
-                options=capacity_df['service_key'].tolist(),
-                format_func=lambda x: capacity_df[capacity_df['service_key'] == x]['service_name'].iloc[0]
+                options=service_keys,
+                format_func=service_names.get
             )
             
             col1, col2 = st.columns(2)
@@ -516,8 +697,8 @@ def show_pricing_tiers():
                     "unit_price": unit_price
                 }
                 
-                new_pricing_df = pd.concat([pricing_df, pd.DataFrame([new_tier])], ignore_index=True)
-                pricing_system.save_pricing_data(new_pricing_df)
+                pricing_df.loc[len(pricing_df)] = new_tier
+                pricing_system.save_pricing_data(pricing_df)
                 st.success(f"✅ تمت إضافة الشريحة '{tier_name}' بنجاح!")
                 st.rerun()
 
@@ -539,8 +720,7 @@ def show_new_quote():
         - حدد مدة صلاحية العرض (عادة 30 يوم)
         
         **2️⃣ اختيار الخدمات:**
-        - افتح كل خدمة من القائمة
-        - أدخل الكمية الشهرية المطلوبة
+        - أدخل الكمية الشهرية المطلوبة لكل خدمة في عمود "الكمية"
         - النظام يحسب السعر تلقائياً حسب الشرائح
         - يمكنك اختيار عدة خدمات
         
@@ -593,40 +773,42 @@ def show_new_quote():
     # اختيار الخدمات
     st.markdown("### 🛒 اختيار الخدمات والكميات")
     
-    selected_services = []
-    results = []
+    # جدول واحد قابل للتعديل لإدخال الكميات بدلاً من عنصر إدخال لكل خدمة
+    volumes_df = capacity_df[[
+        'service_name', 'service_group', 'unit_name', 'monthly_capacity', 'cost_per_unit'
+    ]].assign(volume=0.0)
+    
+    edited_volumes_df = st.data_editor(
+        volumes_df,
+        key="quote_volumes",
+        column_config={
+            'service_name': st.column_config.TextColumn("الخدمة"),
+            'service_group': st.column_config.TextColumn("المجموعة"),
+            'unit_name': st.column_config.TextColumn("الوحدة"),
+            'monthly_capacity': st.column_config.NumberColumn("الطاقة الشهرية", format='%.0f'),
+            'cost_per_unit': st.column_config.NumberColumn("تكلفة الوحدة", format='%.2f ر.س'),
+            'volume': st.column_config.NumberColumn("الكمية", min_value=0.0)
+        },
+        disabled=['service_name', 'service_group', 'unit_name', 'monthly_capacity', 'cost_per_unit'],
+        hide_index=True,
+        use_container_width=True
+    )
     
-    for idx, service in capacity_df.iterrows():
-        with st.expander(f"📦 {service['service_name']}", expanded=False):
-            col1, col2, col3 = st.columns([2, 1, 1])
-            
-            with col1:
-                st.write(f"**المجموعة:** {service['service_group']}")
-                st.write(f"**الوحدة:** {service['unit_name']}")
-                st.write(f"**الطاقة الشهرية:** {service['monthly_capacity']:,.0f}")
-            
-            with col2:
-                st.write(f"**تكلفة الوحدة:** {service['cost_per_unit']:.2f} ر.س")
-            
-            with col3:
-                volume = st.number_input(
-                    f"الكمية ({service['unit_name']})",
-                    min_value=0.0,
-                    value=0.0,
-                    key=f"vol_{service['service_key']}"
-                )
-            
-            if volume > 0:
-                result = pricing_system.calculate_service_pricing(service, volume, pricing_df)
-                results.append(result)
-                selected_services.append(service['service_name'])
+    # حساب تسعير جميع الخدمات المختارة دفعة واحدة
+    volumes = edited_volumes_df['volume'].fillna(0.0).to_numpy(dtype=float)
+    selected_mask = volumes > 0
+    tier_tables = build_tier_tables(
+        pricing_df, str(pricing_system.pricing_file), file_mtime(pricing_system.pricing_file)
+    )
+    results_df = pricing_system.calculate_quote_pricing(
+        capacity_df[selected_mask], volumes[selected_mask], tier_tables
+    )
+    selected_services = results_df['service_name'].tolist()
     
     # عرض النتائج
-    if results:
+    if not results_df.empty:
         st.markdown("### 📊 ملخص عرض السعر")
         
-        results_df = pd.DataFrame(results)
-        
         # المؤشرات الرئيسية
         col1, col2, col3, col4 = st.columns(4)
         
@@ -657,14 +839,15 @@ def show_new_quote():
         ]
         
         st.dataframe(
-            display_df.style.format({
-                'الكمية': '{:,.0f}',
-                'سعر الوحدة': '{:,.2f} ر.س',
-                'الإيراد': '{:,.2f} ر.س',
-                'التكلفة': '{:,.2f} ر.س',
-                'الربح': '{:,.2f} ر.س',
-                'هامش الربح %': '{:.2f}%'
-            }),
+            display_df,
+            column_config={
+                'الكمية': st.column_config.NumberColumn(format='%.0f'),
+                'سعر الوحدة': st.column_config.NumberColumn(format='%.2f ر.س'),
+                'الإيراد': st.column_config.NumberColumn(format='%.2f ر.س'),
+                'التكلفة': st.column_config.NumberColumn(format='%.2f ر.س'),
+                'الربح': st.column_config.NumberColumn(format='%.2f ر.س'),
+                'هامش الربح %': st.column_config.NumberColumn(format='%.2f%%')
+            },
             use_container_width=True
         )
         
@@ -680,18 +863,12 @@ def show_new_quote():
                 'total_cost': total_cost_used,
                 'total_margin': total_margin,
                 'margin_pct': margin_pct,
-                'services_count': len(results),
+                'services_count': len(results_df),
                 'services': ', '.join(selected_services)
             }
             
-            # حفظ في ملف Excel
-            if pricing_system.quotes_file.exists():
-                quotes_df = pd.read_excel(pricing_system.quotes_file)
-                quotes_df = pd.concat([quotes_df, pd.DataFrame([quote_data])], ignore_index=True)
-            else:
-                quotes_df = pd.DataFrame([quote_data])
-            
-            quotes_df.to_excel(pricing_system.quotes_file, index=False)
+            # إلحاق العرض بسجل العروض
+            pricing_system.save_quote(quote_data)
             st.success("✅ تم حفظ عرض السعر بنجاح!")
 
 def show_quotes_history():
@@ -749,36 +926,44 @@ def show_quotes_history():
         - رسوم بيانية توضح الاتجاهات
         """)
     
-    if pricing_system.quotes_file.exists():
-        quotes_df = pd.read_excel(pricing_system.quotes_file)
+    quotes_df = pricing_system.load_quotes_data()
+    
+    if len(quotes_df) > 0:
+        # إحصائيات سريعة
+        col1, col2, col3, col4 = st.columns(4)
         
-        if len(quotes_df) > 0:
-            # إحصائيات سريعة
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                st.metric("عدد العروض", len(quotes_df))
-            with col2:
-                st.metric("إجمالي الإيرادات", f"{quotes_df['total_revenue'].sum():,.0f} ر.س")
-            with col3:
-                st.metric("متوسط قيمة العرض", f"{quotes_df['total_revenue'].mean():,.0f} ر.س")
-            with col4:
-                st.metric("متوسط هامش الربح", f"{quotes_df['margin_pct'].mean():.1f}%")
-            
-            # عرض الجدول
-            st.markdown("### جميع العروض")
-            st.dataframe(
-                quotes_df.style.format({
-                    'total_revenue': '{:,.2f} ر.س',
-                    'total_cost': '{:,.2f} ر.س',
-                    'total_margin': '{:,.2f} ر.س',
-                    'margin_pct': '{:.2f}%'
-                }),
-                use_container_width=True,
-                height=400
-            )
-        else:
-            st.info("📭 لا توجد عروض أسعار محفوظة حتى الآن")
+        with col1:
+            st.metric("عدد العروض", len(quotes_df))
+        with col2:
+            st.metric("إجمالي الإيرادات", f"{quotes_df['total_revenue'].sum():,.0f} ر.س")
+        with col3:
+            st.metric("متوسط قيمة العرض", f"{quotes_df['total_revenue'].mean():,.0f} ر.س")
+        with col4:
+            st.metric("متوسط هامش الربح", f"{quotes_df['margin_pct'].mean():.1f}%")
+        
+        # عرض الجدول
+        st.markdown("### جميع العروض")
+        st.dataframe(
+            quotes_df,
+            column_config={
+                'total_revenue': st.column_config.NumberColumn(format='%.2f ر.س'),
+                'total_cost': st.column_config.NumberColumn(format='%.2f ر.س'),
+                'total_margin': st.column_config.NumberColumn(format='%.2f ر.س'),
+                'margin_pct': st.column_config.NumberColumn(format='%.2f%%')
+            },
+            use_container_width=True,
+            height=400
+        )
+        
+        # تصدير السجل إلى Excel (يُبنى مرة واحدة لكل نسخة من السجل)
+        st.download_button(
+            label="📥 تصدير السجل إلى Excel",
+            data=excel_bytes_cached(
+                quotes_df, str(pricing_system.quotes_file), file_mtime(pricing_system.quotes_file)
+            ),
+            file_name="quotes_history.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
     else:
         st.info("📭 لا توجد عروض أسعار محفوظة حتى الآن")
 
@@ -886,20 +1071,28 @@ def show_excel_template():
                     "working_days", "monthly_cost"
                 ])
             
-            # حفظ في buffer للتحميل المباشر
-            from io import BytesIO
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                capacity_df.to_excel(writer, sheet_name='الطاقة الاستيعابية', index=False)
-            buffer.seek(0)
-            
+            # القالب بصيغة CSV افتراضياً، وبصيغة Excel عند الطلب
+            # (كلاهما يُبنى مرة واحدة لكل نسخة من بيانات الطاقة)
+            capacity_mtime = file_mtime(pricing_system.capacity_file)
             st.download_button(
-                label="📥 تحميل قالب الطاقة",
-                data=buffer,
-                file_name="capacity_template.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                label="📥 تحميل قالب الطاقة (CSV)",
+                data=csv_bytes_cached(capacity_df, str(pricing_system.capacity_file), capacity_mtime),
+                file_name="capacity_template.csv",
+                mime="text/csv",
                 use_container_width=True
             )
+            
+            if st.checkbox("أريد ملف Excel", key="capacity_template_xlsx"):
+                st.download_button(
+                    label="📥 تحميل قالب الطاقة (Excel)",
+                    data=excel_bytes_cached(
+                        capacity_df, str(pricing_system.capacity_file), capacity_mtime,
+                        sheet_name='الطاقة الاستيعابية'
+                    ),
+                    file_name="capacity_template.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True
+                )
         
         with col2:
             st.markdown("#### 💵 قالب شرائح الأسعار")
@@ -913,52 +1106,79 @@ def show_excel_template():
                     "service_key", "tier_name", "min_volume", "max_volume", "unit_price"
                 ])
             
-            # حفظ في buffer للتحميل المباشر
-            buffer2 = BytesIO()
-            with pd.ExcelWriter(buffer2, engine='openpyxl') as writer:
-                pricing_df.to_excel(writer, sheet_name='شرائح الأسعار', index=False)
-            buffer2.seek(0)
-            
+            # القالب بصيغة CSV افتراضياً، وبصيغة Excel عند الطلب
+            # (كلاهما يُبنى مرة واحدة لكل نسخة من بيانات الأسعار)
+            pricing_mtime = file_mtime(pricing_system.pricing_file)
             st.download_button(
-                label="📥 تحميل قالب الأسعار",
-                data=buffer2,
-                file_name="pricing_template.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                label="📥 تحميل قالب الأسعار (CSV)",
+                data=csv_bytes_cached(pricing_df, str(pricing_system.pricing_file), pricing_mtime),
+                file_name="pricing_template.csv",
+                mime="text/csv",
                 use_container_width=True
             )
+            
+            if st.checkbox("أريد ملف Excel", key="pricing_template_xlsx"):
+                st.download_button(
+                    label="📥 تحميل قالب الأسعار (Excel)",
+                    data=excel_bytes_cached(
+                        pricing_df, str(pricing_system.pricing_file), pricing_mtime,
+                        sheet_name='شرائح الأسعار'
+                    ),
+                    file_name="pricing_template.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True
+                )
     
     with tab2:
         st.markdown("### ⬆️ رفع ملفات Excel")
         st.info("""
         📝 **تعليمات الرفع:**
         1. حمّل القالب المناسب من تبويب "تحميل القوالب"
-        2. املأ البيانات في ملف Excel
+        2. املأ البيانات في ملف Excel أو CSV
         3. ارفع الملف هنا لاستيراد البيانات
         """)
         
+        # تغيير مفتاح عناصر الرفع بعد كل حفظ يزيل الملف المرفوع من الجلسة ويحرر ذاكرته
+        upload_round = st.session_state.get('upload_round', 0)
+        
         col1, col2 = st.columns(2)
         
         with col1:
             st.markdown("#### 📊 رفع ملف الطاقة الاستيعابية")
             capacity_file = st.file_uploader(
-                "اختر ملف Excel للطاقة",
-                type=['xlsx', 'xls'],
-                key="capacity_upload"
+                "اختر ملف Excel أو CSV للطاقة",
+                type=['xlsx', 'xls', 'csv'],
+                key=f"capacity_upload_{upload_round}"
             )
             
             if capacity_file is not None:
                 try:
-                    uploaded_capacity_df = pd.read_excel(capacity_file)
-                    st.success(f"✅ تم قراءة الملف بنجاح! ({len(uploaded_capacity_df)} صف)")
+                    # المعاينة تقرأ أول 5 صفوف فقط، والملف كاملاً يُقرأ عند الحفظ
+                    preview_df = read_uploaded_table(capacity_file, nrows=5)
+                    st.success(f"✅ تم قراءة الملف بنجاح! ({capacity_file.name})")
                     
                     st.markdown("##### معاينة البيانات:")
-                    st.dataframe(uploaded_capacity_df.head(), use_container_width=True)
+                    st.dataframe(preview_df, use_container_width=True)
                     
-                    if st.button("💾 حفظ بيانات الطاقة", type="primary", key="save_capacity"):
-                        pricing_system.save_capacity_data(uploaded_capacity_df)
-                        st.success("✅ تم حفظ بيانات الطاقة الاستيعابية بنجاح!")
-                        st.balloons()
-                        st.rerun()
+                    # فحص الأعمدة من المعاينة قبل إتاحة الحفظ، ثم فحص القيم في الملف كاملاً عند الحفظ
+                    required_columns = pricing_system.CAPACITY_UPLOAD_COLUMNS
+                    numeric_columns = pricing_system.CAPACITY_NUMERIC_COLUMNS
+                    upload_errors = pricing_system.upload_errors(preview_df, required_columns, numeric_columns)
+                    for error in upload_errors:
+                        st.error(error)
+                    
+                    if not upload_errors and st.button("💾 حفظ بيانات الطاقة", type="primary", key="save_capacity"):
+                        uploaded_df = read_uploaded_table(capacity_file)
+                        upload_errors = pricing_system.upload_errors(uploaded_df, required_columns, numeric_columns)
+                        for error in upload_errors:
+                            st.error(error)
+                        
+                        if not upload_errors:
+                            pricing_system.save_capacity_data(downcast_integers(uploaded_df))
+                            st.success("✅ تم حفظ بيانات الطاقة الاستيعابية بنجاح!")
+                            st.balloons()
+                            st.session_state.upload_round = upload_round + 1
+                            st.rerun()
                         
                 except Exception as e:
                     st.error(f"❌ خطأ في قراءة الملف: {str(e)}")
@@ -966,28 +1186,155 @@ def show_excel_template():
         with col2:
             st.markdown("#### 💵 رفع ملف شرائح الأسعار")
             pricing_file = st.file_uploader(
-                "اختر ملف Excel للأسعار",
-                type=['xlsx', 'xls'],
-                key="pricing_upload"
+                "اختر ملف Excel أو CSV للأسعار",
+                type=['xlsx', 'xls', 'csv'],
+                key=f"pricing_upload_{upload_round}"
             )
             
             if pricing_file is not None:
                 try:
-                    uploaded_pricing_df = pd.read_excel(pricing_file)
-                    st.success(f"✅ تم قراءة الملف بنجاح! ({len(uploaded_pricing_df)} صف)")
+                    # المعاينة تقرأ أول 5 صفوف فقط، والملف كاملاً يُقرأ عند الحفظ
+                    preview_df = read_uploaded_table(pricing_file, nrows=5)
+                    st.success(f"✅ تم قراءة الملف بنجاح! ({pricing_file.name})")
                     
                     st.markdown("##### معاينة البيانات:")
-                    st.dataframe(uploaded_pricing_df.head(), use_container_width=True)
+                    st.dataframe(preview_df, use_container_width=True)
+                    
+                    # فحص الأعمدة من المعاينة قبل إتاحة الحفظ، ثم فحص القيم في الملف كاملاً عند الحفظ
+                    required_columns = pricing_system.PRICING_UPLOAD_COLUMNS
+                    numeric_columns = pricing_system.PRICING_NUMERIC_COLUMNS
+                    upload_errors = pricing_system.upload_errors(preview_df, required_columns, numeric_columns)
+                    for error in upload_errors:
+                        st.error(error)
                     
-                    if st.button("💾 حفظ شرائح الأسعار", type="primary", key="save_pricing"):
-                        pricing_system.save_pricing_data(uploaded_pricing_df)
-                        st.success("✅ تم حفظ شرائح الأسعار بنجاح!")
-                        st.balloons()
-                        st.rerun()
+                    if not upload_errors and st.button("💾 حفظ شرائح الأسعار", type="primary", key="save_pricing"):
+                        uploaded_df = read_uploaded_table(pricing_file)
+                        upload_errors = pricing_system.upload_errors(uploaded_df, required_columns, numeric_columns)
+                        for error in upload_errors:
+                            st.error(error)
+                        
+                        if not upload_errors:
+                            pricing_system.save_pricing_data(downcast_integers(uploaded_df))
+                            st.success("✅ تم حفظ شرائح الأسعار بنجاح!")
+                            st.balloons()
+                            st.session_state.upload_round = upload_round + 1
+                            st.rerun()
                         
                 except Exception as e:
                     st.error(f"❌ خطأ في قراءة الملف: {str(e)}")
 
+@st.cache_data(show_spinner=False)
+def total_monthly_cost_cached(_capacity_df, source, mtime):
+    """إجمالي التكاليف الشهرية (يُحسب مرة واحدة لكل نسخة من ملف الطاقة)"""
+    return float(_capacity_df['monthly_cost'].sum())
+
+# إعدادات المنزلقات تنتج مفتاحاً جديداً لكل تركيبة، لذا يُحدّ عدد النتائج المخزنة
+_DYNAMIC_CACHE_ENTRIES = 32
+
+@st.cache_data(show_spinner=False, max_entries=_DYNAMIC_CACHE_ENTRIES)
+def compute_dynamic_pricing(_capacity_df, source, mtime, target_margin, expected_utilization, waste_recovery):
+    """حساب الأسعار الديناميكية لكل الخدمات (مخزن حسب نسخة ملف الطاقة وقيم الإعدادات)"""
+    # التكلفة الأساسية للوحدة
+    base_cost = _capacity_df['cost_per_unit'].to_numpy(dtype=float)
+    
+    # حساب تكلفة الهدر للوحدة الواحدة
+    waste_per_unit = (base_cost * (100 - expected_utilization) / expected_utilization) * (waste_recovery / 100)
+    
+    # التكلفة الكلية شاملة الهدر
+    total_cost_per_unit = base_cost + waste_per_unit
+    
+    # السعر المقترح (التكلفة + هامش الربح)
+    suggested_price = total_cost_per_unit * (1 + target_margin / 100)
+    
+    # حساب الربح
+    profit_per_unit = suggested_price - total_cost_per_unit
+    actual_margin = np.where(
+        suggested_price > 0,
+        profit_per_unit / np.where(suggested_price > 0, suggested_price, 1.0) * 100,
+        0.0
+    )
+    
+    # الإيراد والربح المتوقع شهرياً
+    monthly_capacity = _capacity_df['monthly_capacity'].to_numpy(dtype=float)
+    expected_volume = monthly_capacity * (expected_utilization / 100)
+    expected_revenue = expected_volume * suggested_price
+    expected_profit = expected_volume * profit_per_unit
+    
+    return pd.DataFrame({
+        'service_key': _capacity_df['service_key'].to_numpy(),
+        'service_name': _capacity_df['service_name'].to_numpy(),
+        'service_group': _capacity_df['service_group'].to_numpy(),
+        'unit_name': _capacity_df['unit_name'].to_numpy(),
+        'monthly_capacity': monthly_capacity,
+        'expected_volume': expected_volume,
+        'base_cost': base_cost,
+        'waste_cost': waste_per_unit,
+        'total_cost': total_cost_per_unit,
+        'suggested_price': suggested_price,
+        'profit_per_unit': profit_per_unit,
+        'margin_pct': actual_margin,
+        'expected_revenue': expected_revenue,
+        'expected_profit': expected_profit
+    })
+
+@st.cache_data(show_spinner=False, max_entries=_DYNAMIC_CACHE_ENTRIES)
+def dynamic_pricing_figures(_results_df, source, mtime, target_margin, expected_utilization, waste_recovery):
+    """رسوم التسعير الديناميكي (تُبنى مرة واحدة لكل نسخة من البيانات والإعدادات)"""
+    import plotly.graph_objects as go
+    
+    # تمرير الأعمدة كمصفوفات NumPy يختصر تحويل Plotly لها عنصراً عنصراً
+    service_names = _results_df['service_name'].to_numpy()
+    
+    # مقارنة التكلفة vs السعر
+    cost_fig = go.Figure()
+    
+    cost_fig.add_trace(go.Bar(
+        name='التكلفة الكلية',
+        x=service_names,
+        y=_results_df['total_cost'].to_numpy(),
+        marker_color='lightcoral'
+    ))
+    
+    cost_fig.add_trace(go.Bar(
+        name='السعر المقترح',
+        x=service_names,
+        y=_results_df['suggested_price'].to_numpy(),
+        marker_color='lightgreen'
+    ))
+    
+    cost_fig.update_layout(
+        title='مقارنة التكلفة والسعر',
+        xaxis_title='الخدمة',
+        yaxis_title='ر.س',
+        barmode='group',
+        height=400
+    )
+    cost_fig.update_xaxes(tickangle=-45)
+    
+    # توزيع هامش الربح (عمود لكل مجموعة خدمات)
+    margins = _results_df['margin_pct'].to_numpy()
+    group_codes, groups = pd.factorize(_results_df['service_group'])
+    
+    margin_fig = go.Figure([
+        go.Bar(
+            name=str(group),
+            x=service_names[group_codes == code],
+            y=margins[group_codes == code]
+        )
+        for code, group in enumerate(groups)
+    ])
+    
+    margin_fig.update_layout(
+        title='هامش الربح لكل خدمة (%)',
+        xaxis_title='الخدمة',
+        yaxis_title='هامش الربح %',
+        legend_title_text='المجموعة',
+        height=400
+    )
+    margin_fig.update_xaxes(tickangle=-45)
+    
+    return cost_fig, margin_fig
+
 def show_dynamic_pricing():
     """صفحة التسعير الديناميكي الذكي"""
     st.markdown('<div class="section-header"><h2>🤖 التسعير الديناميكي الذكي</h2></div>', unsafe_allow_html=True)
@@ -1071,6 +1418,7 @@ def show_dynamic_pricing():
     """)
     
     capacity_df = pricing_system.load_capacity_data()
+    capacity_mtime = file_mtime(pricing_system.capacity_file)
     
     # التحقق من وجود بيانات
     if capacity_df.empty:
@@ -1121,47 +1469,10 @@ def show_dynamic_pricing():
     # حساب الأسعار الديناميكية
     st.markdown("### 💰 الأسعار المحسوبة تلقائياً")
     
-    pricing_results = []
-    
-    for idx, service in capacity_df.iterrows():
-        # التكلفة الأساسية للوحدة
-        base_cost = service['cost_per_unit']
-        
-        # حساب تكلفة الهدر للوحدة الواحدة
-        waste_per_unit = (base_cost * (100 - expected_utilization) / expected_utilization) * (waste_recovery / 100)
-        
-        # التكلفة الكلية شاملة الهدر
-        total_cost_per_unit = base_cost + waste_per_unit
-        
-        # السعر المقترح (التكلفة + هامش الربح)
-        suggested_price = total_cost_per_unit * (1 + target_margin / 100)
-        
-        # حساب الربح
-        profit_per_unit = suggested_price - total_cost_per_unit
-        actual_margin = (profit_per_unit / suggested_price * 100) if suggested_price > 0 else 0
-        
-        # الإيراد والربح المتوقع شهرياً
-        expected_volume = service['monthly_capacity'] * (expected_utilization / 100)
-        expected_revenue = expected_volume * suggested_price
-        expected_profit = expected_volume * profit_per_unit
-        
-        pricing_results.append({
-            'service_name': service['service_name'],
-            'service_group': service['service_group'],
-            'unit_name': service['unit_name'],
-            'monthly_capacity': service['monthly_capacity'],
-            'expected_volume': expected_volume,
-            'base_cost': base_cost,
-            'waste_cost': waste_per_unit,
-            'total_cost': total_cost_per_unit,
-            'suggested_price': suggested_price,
-            'profit_per_unit': profit_per_unit,
-            'margin_pct': actual_margin,
-            'expected_revenue': expected_revenue,
-            'expected_profit': expected_profit
-        })
-    
-    results_df = pd.DataFrame(pricing_results)
+    results_df = compute_dynamic_pricing(
+        capacity_df, str(pricing_system.capacity_file), capacity_mtime,
+        target_margin, expected_utilization, waste_recovery
+    )
     
     # التحقق من وجود نتائج
     if results_df.empty:
@@ -1169,29 +1480,32 @@ def show_dynamic_pricing():
         return
     
     # عرض المؤشرات الإجمالية
+    total_revenue = results_df['expected_revenue'].sum()
+    total_profit = results_df['expected_profit'].sum()
+    
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.metric(
             "إجمالي الإيراد المتوقع",
-            f"{results_df['expected_revenue'].sum():,.0f} ر.س"
+            f"{total_revenue:,.0f} ر.س"
         )
     
     with col2:
         st.metric(
             "إجمالي الربح المتوقع",
-            f"{results_df['expected_profit'].sum():,.0f} ر.س"
+            f"{total_profit:,.0f} ر.س"
         )
     
     with col3:
-        total_cost = capacity_df['monthly_cost'].sum()
+        total_cost = total_monthly_cost_cached(capacity_df, str(pricing_system.capacity_file), capacity_mtime)
         st.metric(
             "إجمالي التكاليف",
             f"{total_cost:,.0f} ر.س"
         )
     
     with col4:
-        overall_margin = (results_df['expected_profit'].sum() / results_df['expected_revenue'].sum() * 100) if results_df['expected_revenue'].sum() > 0 else 0
+        overall_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
         st.metric(
             "هامش الربح الفعلي",
             f"{overall_margin:.1f}%"
@@ -1212,17 +1526,19 @@ def show_dynamic_pricing():
         'الربح/وحدة', 'هامش الربح %'
     ]
     
+    # التنسيق يتم في المتصفح عبر column_config دون Styler
     st.dataframe(
-        display_df.style.format({
-            'الطاقة الشهرية': '{:,.0f}',
-            'الحجم المتوقع': '{:,.0f}',
-            'التكلفة الأساسية': '{:,.2f} ر.س',
-            'تكلفة الهدر': '{:,.2f} ر.س',
-            'التكلفة الكلية': '{:,.2f} ر.س',
-            'السعر المقترح': '{:,.2f} ر.س',
-            'الربح/وحدة': '{:,.2f} ر.س',
-            'هامش الربح %': '{:.1f}%'
-        }).background_gradient(subset=['السعر المقترح'], cmap='Greens'),
+        display_df,
+        column_config={
+            'الطاقة الشهرية': st.column_config.NumberColumn(format='%.0f'),
+            'الحجم المتوقع': st.column_config.NumberColumn(format='%.0f'),
+            'التكلفة الأساسية': st.column_config.NumberColumn(format='%.2f ر.س'),
+            'تكلفة الهدر': st.column_config.NumberColumn(format='%.2f ر.س'),
+            'التكلفة الكلية': st.column_config.NumberColumn(format='%.2f ر.س'),
+            'السعر المقترح': st.column_config.NumberColumn(format='%.2f ر.س'),
+            'الربح/وحدة': st.column_config.NumberColumn(format='%.2f ر.س'),
+            'هامش الربح %': st.column_config.NumberColumn(format='%.1f%%')
+        },
         use_container_width=True,
         height=500
     )
@@ -1232,49 +1548,18 @@ def show_dynamic_pricing():
     
     col1, col2 = st.columns(2)
     
+    cost_fig, margin_fig = dynamic_pricing_figures(
+        results_df, str(pricing_system.capacity_file), capacity_mtime,
+        target_margin, expected_utilization, waste_recovery
+    )
+    
     with col1:
         # مقارنة التكلفة vs السعر
-        fig = go.Figure()
-        
-        fig.add_trace(go.Bar(
-            name='التكلفة الكلية',
-            x=results_df['service_name'],
-            y=results_df['total_cost'],
-            marker_color='lightcoral'
-        ))
-        
-        fig.add_trace(go.Bar(
-            name='السعر المقترح',
-            x=results_df['service_name'],
-            y=results_df['suggested_price'],
-            marker_color='lightgreen'
-        ))
-        
-        fig.update_layout(
-            title='مقارنة التكلفة والسعر',
-            xaxis_title='الخدمة',
-            yaxis_title='ر.س',
-            barmode='group',
-            height=400
-        )
-        fig.update_xaxes(tickangle=-45)
-        
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(cost_fig, use_container_width=True)
     
     with col2:
         # توزيع هامش الربح
-        fig = px.bar(
-            results_df,
-            x='service_name',
-            y='margin_pct',
-            color='service_group',
-            title='هامش الربح لكل خدمة (%)',
-            labels={'margin_pct': 'هامش الربح %', 'service_name': 'الخدمة'}
-        )
-        fig.update_xaxes(tickangle=-45)
-        fig.update_layout(height=400)
-        
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(margin_fig, use_container_width=True)
     
     # حفظ الأسعار
     st.markdown("### 💾 حفظ الأسعار المحسوبة")
@@ -1292,51 +1577,26 @@ def show_dynamic_pricing():
     
     with col2:
         if st.button("💾 حفظ كشرائح أسعار", type="primary", use_container_width=True):
-            new_tiers = []
-            
-            for _, row in results_df.iterrows():
-                service_key = capacity_df[capacity_df['service_name'] == row['service_name']]['service_key'].iloc[0]
-                base_price = row['suggested_price']
-                
-                # إنشاء 4 شرائح
-                new_tiers.extend([
-                    {
-                        'service_key': service_key,
-                        'tier_name': 'شريحة 1',
-                        'min_volume': 0,
-                        'max_volume': 1000,
-                        'unit_price': base_price
-                    },
-                    {
-                        'service_key': service_key,
-                        'tier_name': 'شريحة 2',
-                        'min_volume': 1001,
-                        'max_volume': 5000,
-                        'unit_price': base_price * 0.9
-                    },
-                    {
-                        'service_key': service_key,
-                        'tier_name': 'شريحة 3',
-                        'min_volume': 5001,
-                        'max_volume': 10000,
-                        'unit_price': base_price * 0.85
-                    },
-                    {
-                        'service_key': service_key,
-                        'tier_name': 'شريحة 4',
-                        'min_volume': 10001,
-                        'max_volume': 0,
-                        'unit_price': base_price * 0.8
-                    }
-                ])
+            # 4 شرائح لكل خدمة تُبنى كأعمدة دفعة واحدة: التكرار لكل خدمة والنمط نفسه لكل الشرائح
+            service_count = len(results_df)
+            tier_discounts = np.tile([1.0, 0.9, 0.85, 0.8], service_count)
             
-            new_pricing_df = pd.DataFrame(new_tiers)
+            new_pricing_df = pd.DataFrame({
+                'service_key': np.repeat(results_df['service_key'].to_numpy(), 4),
+                'tier_name': np.tile(['شريحة 1', 'شريحة 2', 'شريحة 3', 'شريحة 4'], service_count),
+                'min_volume': np.tile([0, 1001, 5001, 10001], service_count),
+                'max_volume': np.tile([1000, 5000, 10000, 0], service_count),
+                'unit_price': np.repeat(results_df['suggested_price'].to_numpy(), 4) * tier_discounts
+            })
             pricing_system.save_pricing_data(new_pricing_df)
             st.success("✅ تم حفظ الأسعار كشرائح تسعير بنجاح!")
             st.balloons()
 
 def show_cma_pricing():
     """صفحة التسعير الإداري CMA"""
+    import plotly.graph_objects as go
+    from cma_pricing_model import CMAPricingModel
+    
     st.markdown('<div class="section-header"><h2>📊 نموذج التسعير الإداري (CMA)</h2></div>', unsafe_allow_html=True)
     
     # شرح الصفحة
@@ -1606,8 +1866,143 @@ def show_cma_pricing():
                 - راقب تغيير الإيراد لمعرفة التأثير الكلي
                 """)
 
+def scenario_comparison_figure(names, revenues, profits):
+    """رسم مقارنة السيناريوهات"""
+    import plotly.graph_objects as go
+    
+    # مسار واحد على محور من مستويين (السيناريو ثم المؤشر) بدلاً من مسار لكل مؤشر
+    n_scenarios = len(names)
+    fig = go.Figure(go.Bar(
+        x=[np.repeat(names, 2), np.tile(['الإيراد', 'الربح'], n_scenarios)],
+        y=np.column_stack([revenues, profits]).ravel(),
+        marker_color=np.tile(['lightblue', 'lightgreen'], n_scenarios)
+    ))
+    fig.update_layout(
+        title='مقارنة السيناريوهات',
+        height=400
+    )
+    return fig
+
+@fragment
+def render_advanced_report(model):
+    """قسم التقرير الشامل (يُعاد تنفيذه وحده عند الضغط على زر التوليد دون إعادة تشغيل الصفحة)"""
+    if st.button("📊 توليد التقرير الشامل", type="primary", use_container_width=True):
+        report = model.generate_comprehensive_report()
+        
+        if 'error' in report:
+            st.error(report['error'])
+        else:
+            st.success("✅ تم توليد التقرير بنجاح!")
+            
+            # تصدير التقرير كاملاً بصيغة JSON
+            st.download_button(
+                label="📥 تحميل التقرير (JSON)",
+                data=model.generate_comprehensive_report_json(),
+                file_name="comprehensive_report.json",
+                mime="application/json"
+            )
+            
+            # عرض النتائج
+            st.markdown("## 📋 التقرير الشامل")
+            
+            # التكاليف
+            st.markdown("### 💰 تحليل التكاليف")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("التكلفة المتغيرة/وحدة", f"{report['cost_analysis']['variable_cost_per_unit']:.2f} ر.س")
+            with col2:
+                st.metric("التكلفة الثابتة/وحدة", f"{report['cost_analysis']['fixed_cost_per_unit']:.2f} ر.س")
+            with col3:
+                st.metric("التكلفة الكلية/وحدة", f"{report['cost_analysis']['total_cost_per_unit']:.2f} ر.س")
+            
+            # تسعير دورة الحياة
+            st.markdown("### 🔄 تسعير دورة الحياة")
+            lifecycle = report['lifecycle_pricing']
+            min_markup, max_markup = lifecycle['recommended_markup_range']
+            st.info(f"""
+            **المرحلة:** {lifecycle['strategy']}
+            
+            **التركيز:** {lifecycle['focus']}
+            
+            **نطاق السعر المقترح:**
+            - الحد الأدنى: {lifecycle['price_range']['min']:.2f} ر.س
+            - الحد الأقصى: {lifecycle['price_range']['max']:.2f} ر.س
+            
+            **نطاق هامش الربح المقترح:** {min_markup*100:.0f}% - {max_markup*100:.0f}%
+            """)
+            
+            # التسعير النفسي
+            st.markdown("### 🎭 التسعير النفسي")
+            psych = report['recommendations']['psychological_pricing'].values()
+            psych_data = pd.DataFrame({
+                'الاستراتيجية': [d['description'] for d in psych],
+                'السعر المقترح': [d['price'] for d in psych],
+                'القيمة المدركة': [d['perceived_value'] for d in psych]
+            })
+            st.dataframe(
+                psych_data,
+                column_config={'السعر المقترح': st.column_config.NumberColumn(format="%.2f ر.س")},
+                use_container_width=True
+            )
+            
+            # الخصومات
+            st.markdown("### 🎁 استراتيجيات الخصم")
+            
+            # خصومات الكمية
+            st.markdown("#### خصومات الكمية")
+            qty_discounts = report['recommendations']['discount_strategies'].get('quantity_discounts', {})
+            if qty_discounts:
+                tiers = qty_discounts.values()
+                qty_data = pd.DataFrame({
+                    'الشريحة': list(qty_discounts),
+                    'الحد الأدنى': [d['conditions']['min_quantity'] for d in tiers],
+                    'الخصم': [d['discount_percentage'] for d in tiers],
+                    'السعر بعد الخصم': [d['discounted_price'] for d in tiers]
+                })
+                st.dataframe(
+                    qty_data,
+                    column_config={
+                        'الخصم': st.column_config.NumberColumn(format="%.0f%%"),
+                        'السعر بعد الخصم': st.column_config.NumberColumn(format="%.2f ر.س")
+                    },
+                    use_container_width=True
+                )
+            
+            # السيناريوهات
+            if model.scenarios:
+                st.markdown("### 🎯 مقارنة السيناريوهات")
+                scenarios = model.scenarios.values()
+                df_scenarios = pd.DataFrame({
+                    'السيناريو': list(model.scenarios),
+                    'السعر': [s.analysis['base_price'] for s in scenarios],
+                    'الحجم': [s.analysis['expected_volume'] for s in scenarios],
+                    'الإيراد': [s.analysis['revenue'] for s in scenarios],
+                    'الربح': [s.analysis['profit'] for s in scenarios],
+                    'هامش الربح': [s.analysis['profit_margin'] for s in scenarios]
+                })
+                st.dataframe(
+                    df_scenarios,
+                    column_config={
+                        'السعر': st.column_config.NumberColumn(format="%.2f ر.س"),
+                        'الإيراد': st.column_config.NumberColumn(format="%.0f ر.س"),
+                        'الربح': st.column_config.NumberColumn(format="%.0f ر.س"),
+                        'هامش الربح': st.column_config.NumberColumn(format="%.1f%%")
+                    },
+                    use_container_width=True
+                )
+                
+                # رسم بياني
+                fig = scenario_comparison_figure(
+                    df_scenarios['السيناريو'].to_numpy(),
+                    df_scenarios['الإيراد'].to_numpy(),
+                    df_scenarios['الربح'].to_numpy()
+                )
+                st.plotly_chart(fig, use_container_width=True)
+
 def show_advanced_pricing():
     """صفحة نموذج التسعير المتقدم"""
+    from advanced_pricing_model import AdvancedPricingModel
+    
     st.markdown('<div class="section-header"><h2>🎯 نموذج التسعير المتقدم</h2></div>', unsafe_allow_html=True)
     
     # شرح الصفحة
@@ -1693,31 +2088,34 @@ def show_advanced_pricing():
     with tab1:
         st.markdown("### إدخال التكاليف المفصلة")
         
-        col1, col2 = st.columns(2)
+        with st.form("cost_form"):
+            col1, col2 = st.columns(2)
         
-        with col1:
-            st.markdown("#### التكاليف المباشرة (للوحدة)")
-            direct_materials = st.number_input("مواد خام مباشرة (ر.س)", min_value=0.0, value=100.0, step=1.0)
-            direct_labor = st.number_input("عمالة مباشرة (ر.س)", min_value=0.0, value=25.0, step=1.0)
-            variable_overhead = st.number_input("تكاليف متغيرة إضافية (ر.س)", min_value=0.0, value=15.0, step=1.0)
+            with col1:
+                st.markdown("#### التكاليف المباشرة (للوحدة)")
+                direct_materials = st.number_input("مواد خام مباشرة (ر.س)", min_value=0.0, value=100.0, step=1.0)
+                direct_labor = st.number_input("عمالة مباشرة (ر.س)", min_value=0.0, value=25.0, step=1.0)
+                variable_overhead = st.number_input("تكاليف متغيرة إضافية (ر.س)", min_value=0.0, value=15.0, step=1.0)
         
-        with col2:
-            st.markdown("#### التكاليف الثابتة (شهرياً)")
-            fixed_overhead = st.number_input("تكاليف إنتاج ثابتة (ر.س)", min_value=0.0, value=500000.0, step=1000.0)
-            rnd_costs = st.number_input("بحث وتطوير (ر.س)", min_value=0.0, value=200000.0, step=1000.0)
-            marketing_costs = st.number_input("تسويق (ر.س)", min_value=0.0, value=300000.0, step=1000.0)
-            administrative_costs = st.number_input("إدارية (ر.س)", min_value=0.0, value=150000.0, step=1000.0)
+            with col2:
+                st.markdown("#### التكاليف الثابتة (شهرياً)")
+                fixed_overhead = st.number_input("تكاليف إنتاج ثابتة (ر.س)", min_value=0.0, value=500000.0, step=1000.0)
+                rnd_costs = st.number_input("بحث وتطوير (ر.س)", min_value=0.0, value=200000.0, step=1000.0)
+                marketing_costs = st.number_input("تسويق (ر.س)", min_value=0.0, value=300000.0, step=1000.0)
+                administrative_costs = st.number_input("إدارية (ر.س)", min_value=0.0, value=150000.0, step=1000.0)
         
-        st.markdown("#### بيانات الإنتاج")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            expected_units = st.number_input("الوحدات المتوقعة (شهرياً)", min_value=1, value=25000, step=100)
-        with col2:
-            capacity_units = st.number_input("الطاقة القصوى (شهرياً)", min_value=1, value=30000, step=100)
-        with col3:
-            production_cycle = st.number_input("دورة الإنتاج (أيام)", min_value=1, value=30, step=1)
+            st.markdown("#### بيانات الإنتاج")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                expected_units = st.number_input("الوحدات المتوقعة (شهرياً)", min_value=1, value=25000, step=100)
+            with col2:
+                capacity_units = st.number_input("الطاقة القصوى (شهرياً)", min_value=1, value=30000, step=100)
+            with col3:
+                production_cycle = st.number_input("دورة الإنتاج (أيام)", min_value=1, value=30, step=1)
+            
+            submitted = st.form_submit_button("💾 حفظ التكاليف", type="primary")
         
-        if st.button("💾 حفظ التكاليف", type="primary", key="save_costs"):
+        if submitted:
             cost_structure = {
                 'direct_materials': direct_materials,
                 'direct_labor': direct_labor,
@@ -1736,36 +2134,34 @@ def show_advanced_pricing():
             # عرض ملخص
             st.info(f"""
             **ملخص التكاليف:**
-            - التكلفة المتغيرة/وحدة: {model.cost_data['variable_cost_per_unit']:.2f} ر.س
-            - التكلفة الثابتة/وحدة: {model.cost_data['fixed_cost_per_unit']:.2f} ر.س
-            - **التكلفة الكلية/وحدة: {model.cost_data['total_cost_per_unit']:.2f} ر.س**
+            - التكلفة المتغيرة/وحدة: {model.cost_data.variable_cost_per_unit:.2f} ر.س
+            - التكلفة الثابتة/وحدة: {model.cost_data.fixed_cost_per_unit:.2f} ر.س
+            - **التكلفة الكلية/وحدة: {model.cost_data.total_cost_per_unit:.2f} ر.س**
             """)
     
     with tab2:
         st.markdown("### بيانات السوق والتحليل")
         
-        col1, col2 = st.columns(2)
+        with st.form("market_form"):
+            col1, col2 = st.columns(2)
         
-        with col1:
-            market_price = st.number_input("سعر السوق الحالي (ر.س)", min_value=0.0, value=450.0, step=1.0)
-            price_elasticity = st.slider("مرونة الطلب السعرية", min_value=-5.0, max_value=0.0, value=-1.8, step=0.1)
-            market_growth = st.slider("معدل نمو السوق (%)", min_value=0, max_value=50, value=8, step=1) / 100
+            with col1:
+                market_price = st.number_input("سعر السوق الحالي (ر.س)", min_value=0.0, value=450.0, step=1.0)
+                price_elasticity = st.slider("مرونة الطلب السعرية", min_value=-5.0, max_value=0.0, value=-1.8, step=0.1)
+                market_growth = st.slider("معدل نمو السوق (%)", min_value=0, max_value=50, value=8, step=1) / 100
         
-        with col2:
-            lifecycle_stage = st.selectbox(
-                "مرحلة دورة حياة المنتج",
-                ["introduction", "growth", "maturity", "decline"],
-                format_func=lambda x: {
-                    "introduction": "🌱 تقديم",
-                    "growth": "📈 نمو",
-                    "maturity": "⚖️ نضج",
-                    "decline": "📉 انحدار"
-                }[x]
-            )
-            market_share_target = st.slider("الحصة السوقية المستهدفة (%)", min_value=1, max_value=50, value=15, step=1) / 100
-            seasonality = st.slider("عامل الموسمية", min_value=0.5, max_value=2.0, value=1.0, step=0.1)
+            with col2:
+                lifecycle_stage = st.selectbox(
+                    "مرحلة دورة حياة المنتج",
+                    _LIFECYCLE_STAGES,
+                    format_func=_LIFECYCLE_LABELS.__getitem__
+                )
+                market_share_target = st.slider("الحصة السوقية المستهدفة (%)", min_value=1, max_value=50, value=15, step=1) / 100
+                seasonality = st.slider("عامل الموسمية", min_value=0.5, max_value=2.0, value=1.0, step=0.1)
+            
+            submitted = st.form_submit_button("💾 حفظ بيانات السوق", type="primary")
         
-        if st.button("💾 حفظ بيانات السوق", type="primary", key="save_market"):
+        if submitted:
             market_analysis = {
                 'current_market_price': market_price,
                 'price_elasticity': price_elasticity,
@@ -1794,11 +2190,23 @@ def show_advanced_pricing():
                 model.add_competitor(comp_name, comp_price, comp_share)
                 st.success(f"✅ تم إضافة {comp_name}")
         
-        if model.competitor_data:
+        if len(model.competitor_data):
             st.markdown("#### المنافسون الحاليون")
-            comp_df = pd.DataFrame(model.competitor_data)
-            comp_df.columns = ['الاسم', 'السعر', 'الحصة السوقية', 'هيكل التكاليف']
-            st.dataframe(comp_df[['الاسم', 'السعر', 'الحصة السوقية']], use_container_width=True)
+            comp = model.competitor_data
+            comp_df = pd.DataFrame({
+                'الاسم': comp['name'],
+                'السعر': comp['price'],
+                'الحصة السوقية': comp['market_share']
+            })
+            st.dataframe(
+                comp_df,
+                column_config={
+                    'السعر': st.column_config.NumberColumn(format="%.2f ر.س"),
+                    'الحصة السوقية': st.column_config.NumberColumn(format="%.2f")
+                },
+                hide_index=True,
+                use_container_width=True
+            )
     
     with tab4:
         st.markdown("### إنشاء سيناريوهات التسعير")
@@ -1812,7 +2220,7 @@ def show_advanced_pricing():
             with col2:
                 scenario_volume = st.number_input("الكمية المتوقعة", min_value=1, value=20000, step=100)
             with col3:
-                scenario_condition = st.selectbox("ظروف السوق", ["stable", "competitive", "penetration", "premium"])
+                scenario_condition = st.selectbox("ظروف السوق", _MARKET_CONDITIONS)
             
             submitted_scenario = st.form_submit_button("➕ إضافة سيناريو", type="primary")
             if submitted_scenario and scenario_name:
@@ -1825,123 +2233,121 @@ def show_advanced_pricing():
         
         if model.scenarios:
             st.markdown("#### السيناريوهات الحالية")
-            for name, data in model.scenarios.items():
-                analysis = data['analysis']
-                st.info(f"""
-                **{name}**
-                - السعر: {analysis['base_price']:.2f} ر.س
-                - الربح: {analysis['profit']:,.0f} ر.س
-                - هامش الربح: {analysis['profit_margin']:.1f}%
-                - نقطة التعادل: {analysis['break_even_point']:.0f} وحدة
-                """)
+            # جدول واحد بدلاً من بطاقة لكل سيناريو
+            analyses = [data.analysis for data in model.scenarios.values()]
+            st.dataframe(
+                pd.DataFrame({
+                    'السيناريو': list(model.scenarios),
+                    'السعر': [a['base_price'] for a in analyses],
+                    'الربح': [a['profit'] for a in analyses],
+                    'هامش الربح': [a['profit_margin'] for a in analyses],
+                    'نقطة التعادل': [a['break_even_point'] for a in analyses]
+                }),
+                column_config={
+                    'السعر': st.column_config.NumberColumn(format="%.2f ر.س"),
+                    'الربح': st.column_config.NumberColumn(format="%.0f ر.س"),
+                    'هامش الربح': st.column_config.NumberColumn(format="%.1f%%"),
+                    'نقطة التعادل': st.column_config.NumberColumn(format="%.0f وحدة")
+                },
+                hide_index=True,
+                use_container_width=True
+            )
     
     # زر توليد التقرير
     st.markdown("---")
-    if st.button("📊 توليد التقرير الشامل", type="primary", use_container_width=True):
-        report = model.generate_comprehensive_report()
-        
-        if 'error' in report:
-            st.error(report['error'])
+    render_advanced_report(model)
+
+@fragment
+def render_segment_pricing(model):
+    """حساب أسعار الشرائح (يُعاد تنفيذه وحده عند الضغط على زر الحساب)"""
+    if st.button("🎯 حساب الأسعار المثلى للشرائح", key="calc_seg"):
+        segmented_pricing = model.calculate_segmented_pricing()
+        
+        if 'error' not in segmented_pricing:
+            st.markdown("#### 📊 الأسعار المقترحة")
+            for seg_name, seg_data in segmented_pricing.items():
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric(f"{seg_name} - السعر", f"{seg_data['optimal_price']:.2f} ر.س")
+                with col2:
+                    st.metric("هامش الربح", f"{seg_data['target_margin']:.1f}%")
+                with col3:
+                    st.metric("الحجم المتوقع", f"{seg_data['expected_volume']:,}")
         else:
-            st.success("✅ تم توليد التقرير بنجاح!")
-            
-            # عرض النتائج
-            st.markdown("## 📋 التقرير الشامل")
-            
-            # التكاليف
-            st.markdown("### 💰 تحليل التكاليف")
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("التكلفة المتغيرة/وحدة", f"{report['cost_analysis']['variable_cost_per_unit']:.2f} ر.س")
-            with col2:
-                st.metric("التكلفة الثابتة/وحدة", f"{report['cost_analysis']['fixed_cost_per_unit']:.2f} ر.س")
-            with col3:
-                st.metric("التكلفة الكلية/وحدة", f"{report['cost_analysis']['total_cost_per_unit']:.2f} ر.س")
-            
-            # تسعير دورة الحياة
-            st.markdown("### 🔄 تسعير دورة الحياة")
-            lifecycle = report['lifecycle_pricing']
-            st.info(f"""
-            **المرحلة:** {lifecycle['strategy']}
-            
-            **التركيز:** {lifecycle['focus']}
-            
-            **نطاق السعر المقترح:**
-            - الحد الأدنى: {lifecycle['price_range']['min']:.2f} ر.س
-            - الحد الأقصى: {lifecycle['price_range']['max']:.2f} ر.س
-            
-            **نطاق هامش الربح المقترح:** {lifecycle['recommended_markup_range']}
-            """)
-            
-            # التسعير النفسي
-            st.markdown("### 🎭 التسعير النفسي")
-            psych_data = []
-            for strategy, details in report['recommendations']['psychological_pricing'].items():
-                psych_data.append({
-                    'الاستراتيجية': details['description'],
-                    'السعر المقترح': f"{details['price']:.2f} ر.س",
-                    'القيمة المدركة': details['perceived_value']
-                })
-            st.dataframe(pd.DataFrame(psych_data), use_container_width=True)
+            st.error(segmented_pricing['error'])
+
+def risk_scores_figure(risk_scores):
+    """رسم المخاطر حسب الفئة"""
+    import plotly.graph_objects as go
+    
+    fig = go.Figure(data=[
+        go.Bar(x=_RISK_LABELS, y=risk_scores, marker_color=_RISK_COLORS)
+    ])
+    fig.update_layout(
+        title='تحليل المخاطر حسب الفئة',
+        yaxis_title='درجة المخاطر (0-10)',
+        height=300
+    )
+    return fig
+
+@fragment
+def render_risk_assessment(model):
+    """قسم تقييم المخاطر (يُعاد تنفيذه وحده عند الضغط على زر التقييم)"""
+    if st.button("🎲 تقييم المخاطر", type="primary", key="assess_risks"):
+        risks = model.assess_market_risks()
+        
+        # عرض درجة المخاطر الإجمالية
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            st.metric(
+                "درجة المخاطر الإجمالية",
+                f"{risks['overall_risk_score']:.1f}/10",
+                delta=None
+            )
             
-            # الخصومات
-            st.markdown("### 🎁 استراتيجيات الخصم")
+            risk_level = risks['risk_level']
+            if risk_level == 'منخفض':
+                st.success(f"✅ مستوى المخاطرة: {risk_level}")
+            elif risk_level == 'متوسط':
+                st.warning(f"⚠️ مستوى المخاطرة: {risk_level}")
+            else:
+                st.error(f"❌ مستوى المخاطرة: {risk_level}")
+        
+        with col2:
+            # رسم بياني للمخاطر
+            risk_scores = [risks[category]['score'] for category in _RISK_CATEGORIES]
+            st.plotly_chart(risk_scores_figure(risk_scores), use_container_width=True)
+        
+        # تفاصيل كل نوع مخاطر
+        st.markdown("---")
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.markdown("#### 🏆 المخاطر التنافسية")
+            st.metric("الدرجة", f"{risks['competitive_risks']['score']:.1f}/10")
+            for factor in risks['competitive_risks']['factors']:
+                st.write(f"• {factor}")
             
-            # خصومات الكمية
-            st.markdown("#### خصومات الكمية")
-            qty_discounts = report['recommendations']['discount_strategies'].get('quantity_discounts', {})
-            if qty_discounts:
-                qty_data = []
-                for tier, details in qty_discounts.items():
-                    qty_data.append({
-                        'الشريحة': tier,
-                        'الحد الأدنى': details['conditions']['min_quantity'],
-                        'الخصم': f"{details['discount_percentage']:.0f}%",
-                        'السعر بعد الخصم': f"{details['discounted_price']:.2f} ر.س"
-                    })
-                st.dataframe(pd.DataFrame(qty_data), use_container_width=True)
+            st.markdown("#### ⚖️ المخاطر التنظيمية")
+            st.metric("الدرجة", f"{risks['regulatory_risks']['score']:.1f}/10")
+            for factor in risks['regulatory_risks']['factors']:
+                st.write(f"• {factor}")
+        
+        with col2:
+            st.markdown("#### 📈 مخاطر الطلب")
+            st.metric("الدرجة", f"{risks['demand_risks']['score']:.1f}/10")
+            for factor in risks['demand_risks']['factors']:
+                st.write(f"• {factor}")
             
-            # السيناريوهات
-            if model.scenarios:
-                st.markdown("### 🎯 مقارنة السيناريوهات")
-                scenario_comparison = []
-                for name, data in model.scenarios.items():
-                    analysis = data['analysis']
-                    scenario_comparison.append({
-                        'السيناريو': name,
-                        'السعر': f"{analysis['base_price']:.2f} ر.س",
-                        'الحجم': analysis['expected_volume'],
-                        'الإيراد': f"{analysis['revenue']:,.0f} ر.س",
-                        'الربح': f"{analysis['profit']:,.0f} ر.س",
-                        'هامش الربح': f"{analysis['profit_margin']:.1f}%"
-                    })
-                
-                df_scenarios = pd.DataFrame(scenario_comparison)
-                st.dataframe(df_scenarios, use_container_width=True)
-                
-                # رسم بياني
-                fig = go.Figure()
-                fig.add_trace(go.Bar(
-                    name='الإيراد',
-                    x=[s['السيناريو'] for s in scenario_comparison],
-                    y=[float(s['الإيراد'].replace(' ر.س', '').replace(',', '')) for s in scenario_comparison],
-                    marker_color='lightblue'
-                ))
-                fig.add_trace(go.Bar(
-                    name='الربح',
-                    x=[s['السيناريو'] for s in scenario_comparison],
-                    y=[float(s['الربح'].replace(' ر.س', '').replace(',', '')) for s in scenario_comparison],
-                    marker_color='lightgreen'
-                ))
-                fig.update_layout(
-                    title='مقارنة السيناريوهات',
-                    barmode='group',
-                    height=400
-                )
-                st.plotly_chart(fig, use_container_width=True)
+            st.markdown("#### 🚚 مخاطر سلسلة التوريد")
+            st.metric("الدرجة", f"{risks['supply_chain_risks']['score']:.1f}/10")
+            for factor in risks['supply_chain_risks']['factors']:
+                st.write(f"• {factor}")
 
 def show_enterprise_pricing():
     """صفحة نموذج التسعير المؤسسي المتقدم"""
+    from enterprise_pricing_model import EnterprisePricingModel
+    
     st.markdown('<div class="section-header"><h2>🏢 نموذج التسعير المؤسسي</h2></div>', unsafe_allow_html=True)
     
     # شرح الصفحة
@@ -2001,7 +2407,7 @@ def show_enterprise_pricing():
     
     if st.session_state.ent_model is None or st.button("🔄 إعادة تعيين النموذج", key="reset_ent"):
         st.session_state.ent_model = EnterprisePricingModel(product_name)
-        st.session_state.ent_segments = {}
+        st.session_state.ent_segments = []
         st.session_state.ent_campaigns = []
         st.success("✅ تم إنشاء نموذج جديد")
     
@@ -2020,23 +2426,26 @@ def show_enterprise_pricing():
     with tab1:
         st.markdown("### إدخال البيانات الأساسية")
         
-        col1, col2 = st.columns(2)
+        with st.form("ent_basic_form"):
+            col1, col2 = st.columns(2)
         
-        with col1:
-            st.markdown("#### 💵 التكاليف")
-            direct_materials = st.number_input("مواد خام (ر.س)", min_value=0.0, value=80.0, step=1.0, key="ent_mat")
-            direct_labor = st.number_input("عمالة (ر.س)", min_value=0.0, value=20.0, step=1.0, key="ent_labor")
-            variable_overhead = st.number_input("تكاليف متغيرة (ر.س)", min_value=0.0, value=15.0, step=1.0, key="ent_var")
-            fixed_overhead = st.number_input("تكاليف ثابتة (ر.س)", min_value=0.0, value=300000.0, step=1000.0, key="ent_fixed")
+            with col1:
+                st.markdown("#### 💵 التكاليف")
+                direct_materials = st.number_input("مواد خام (ر.س)", min_value=0.0, value=80.0, step=1.0, key="ent_mat")
+                direct_labor = st.number_input("عمالة (ر.س)", min_value=0.0, value=20.0, step=1.0, key="ent_labor")
+                variable_overhead = st.number_input("تكاليف متغيرة (ر.س)", min_value=0.0, value=15.0, step=1.0, key="ent_var")
+                fixed_overhead = st.number_input("تكاليف ثابتة (ر.س)", min_value=0.0, value=300000.0, step=1000.0, key="ent_fixed")
         
-        with col2:
-            st.markdown("#### 📈 بيانات السوق")
-            market_price = st.number_input("سعر السوق (ر.س)", min_value=0.0, value=180.0, step=1.0, key="ent_price")
-            price_elasticity = st.slider("مرونة الطلب", min_value=-5.0, max_value=0.0, value=-2.0, step=0.1, key="ent_elast")
-            market_growth = st.slider("نمو السوق (%)", min_value=0, max_value=50, value=6, step=1, key="ent_growth") / 100
-            expected_units = st.number_input("الوحدات المتوقعة", min_value=1, value=20000, step=100, key="ent_units")
+            with col2:
+                st.markdown("#### 📈 بيانات السوق")
+                market_price = st.number_input("سعر السوق (ر.س)", min_value=0.0, value=180.0, step=1.0, key="ent_price")
+                price_elasticity = st.slider("مرونة الطلب", min_value=-5.0, max_value=0.0, value=-2.0, step=0.1, key="ent_elast")
+                market_growth = st.slider("نمو السوق (%)", min_value=0, max_value=50, value=6, step=1, key="ent_growth") / 100
+                expected_units = st.number_input("الوحدات المتوقعة", min_value=1, value=20000, step=100, key="ent_units")
+            
+            submitted = st.form_submit_button("💾 حفظ البيانات الأساسية", type="primary")
         
-        if st.button("💾 حفظ البيانات الأساسية", type="primary", key="save_ent_basic"):
+        if submitted:
             cost_structure = {
                 'direct_materials': direct_materials,
                 'direct_labor': direct_labor,
@@ -2061,7 +2470,7 @@ def show_enterprise_pricing():
             model.input_market_analysis(market_analysis)
             
             st.success("✅ تم حفظ البيانات!")
-            st.info(f"**التكلفة الإجمالية/وحدة:** {model.cost_data.get('total_cost_per_unit', 0):.2f} ر.s")
+            st.info(f"**التكلفة الإجمالية/وحدة:** {model.cost_data.total_cost_per_unit:.2f} ر.s")
     
     with tab2:
         st.markdown("### 👥 إدارة شرائح العملاء")
@@ -2089,48 +2498,40 @@ def show_enterprise_pricing():
             
             submitted_seg = st.form_submit_button("➕ إضافة شريحة", type="primary")
             if submitted_seg and seg_name:
-                if 'ent_segments' not in st.session_state:
-                    st.session_state.ent_segments = {}
+                # الشرائح محفوظة كصفوف (الاسم، الحجم، استعداد الدفع، الحساسية)، وإعادة إضافة اسم موجود تستبدله
+                segments = [seg for seg in st.session_state.get('ent_segments', []) if seg[0] != seg_name]
+                segments.append((seg_name, seg_size, seg_wtp, seg_sensitivity))
+                st.session_state.ent_segments = segments
                 
-                st.session_state.ent_segments[seg_name] = {
-                    'size': seg_size,
-                    'willingness_to_pay_multiplier': seg_wtp,
-                    'price_sensitivity': seg_sensitivity
-                }
-                model.define_customer_segments(st.session_state.ent_segments)
+                model.define_customer_segments({
+                    name: {
+                        'size': size,
+                        'willingness_to_pay_multiplier': wtp,
+                        'price_sensitivity': sensitivity
+                    }
+                    for name, size, wtp, sensitivity in segments
+                })
                 st.success(f"✅ تم إضافة شريحة: {seg_name}")
                 st.rerun()
         
         # عرض الشرائح الحالية
         if 'ent_segments' in st.session_state and st.session_state.ent_segments:
             st.markdown("#### الشرائح الحالية")
-            segments_df = pd.DataFrame([
-                {
-                    'الشريحة': name,
-                    'الحجم': data['size'],
-                    'استعداد الدفع': f"{data['willingness_to_pay_multiplier']:.1f}x",
-                    'حساسية السعر': f"{data['price_sensitivity']:.1f}"
-                }
-                for name, data in st.session_state.ent_segments.items()
-            ])
-            st.dataframe(segments_df, use_container_width=True)
+            segments_df = pd.DataFrame(
+                st.session_state.ent_segments,
+                columns=['الشريحة', 'الحجم', 'استعداد الدفع', 'حساسية السعر']
+            )
+            st.dataframe(
+                segments_df,
+                column_config={
+                    'استعداد الدفع': st.column_config.NumberColumn(format="%.1fx"),
+                    'حساسية السعر': st.column_config.NumberColumn(format="%.1f")
+                },
+                use_container_width=True
+            )
             
             # حساب التسعير المتمايز
-            if st.button("🎯 حساب الأسعار المثلى للشرائح", key="calc_seg"):
-                segmented_pricing = model.calculate_segmented_pricing()
-                
-                if 'error' not in segmented_pricing:
-                    st.markdown("#### 📊 الأسعار المقترحة")
-                    for seg_name, seg_data in segmented_pricing.items():
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric(f"{seg_name} - السعر", f"{seg_data['optimal_price']:.2f} ر.س")
-                        with col2:
-                            st.metric("هامش الربح", f"{seg_data['target_margin']:.1f}%")
-                        with col3:
-                            st.metric("الحجم المتوقع", f"{seg_data['expected_volume']:,}")
-                else:
-                    st.error(segmented_pricing['error'])
+            render_segment_pricing(model)
     
     with tab3:
         st.markdown("### 📢 الحملات الترويجية")
@@ -2235,71 +2636,7 @@ def show_enterprise_pricing():
     with tab5:
         st.markdown("### 📊 تقييم المخاطر الشامل")
         
-        if st.button("🎲 تقييم المخاطر", type="primary", key="assess_risks"):
-            risks = model.assess_market_risks()
-            
-            # عرض درجة المخاطر الإجمالية
-            col1, col2 = st.columns([1, 2])
-            with col1:
-                st.metric(
-                    "درجة المخاطر الإجمالية",
-                    f"{risks['overall_risk_score']:.1f}/10",
-                    delta=None
-                )
-                
-                risk_level = risks['risk_level']
-                if risk_level == 'منخفض':
-                    st.success(f"✅ مستوى المخاطرة: {risk_level}")
-                elif risk_level == 'متوسط':
-                    st.warning(f"⚠️ مستوى المخاطرة: {risk_level}")
-                else:
-                    st.error(f"❌ مستوى المخاطرة: {risk_level}")
-            
-            with col2:
-                # رسم بياني للمخاطر
-                risk_categories = ['تنافسية', 'الطلب', 'تنظيمية', 'سلسلة التوريد']
-                risk_scores = [
-                    risks['competitive_risks']['score'],
-                    risks['demand_risks']['score'],
-                    risks['regulatory_risks']['score'],
-                    risks['supply_chain_risks']['score']
-                ]
-                
-                fig = go.Figure(data=[
-                    go.Bar(x=risk_categories, y=risk_scores, marker_color=['#ff6b6b', '#ffd93d', '#6bcf7f', '#4d96ff'])
-                ])
-                fig.update_layout(
-                    title='تحليل المخاطر حسب الفئة',
-                    yaxis_title='درجة المخاطر (0-10)',
-                    height=300
-                )
-                st.plotly_chart(fig, use_container_width=True)
-            
-            # تفاصيل كل نوع مخاطر
-            st.markdown("---")
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.markdown("#### 🏆 المخاطر التنافسية")
-                st.metric("الدرجة", f"{risks['competitive_risks']['score']:.1f}/10")
-                for factor in risks['competitive_risks']['factors']:
-                    st.write(f"• {factor}")
-                
-                st.markdown("#### ⚖️ المخاطر التنظيمية")
-                st.metric("الدرجة", f"{risks['regulatory_risks']['score']:.1f}/10")
-                for factor in risks['regulatory_risks']['factors']:
-                    st.write(f"• {factor}")
-            
-            with col2:
-                st.markdown("#### 📈 مخاطر الطلب")
-                st.metric("الدرجة", f"{risks['demand_risks']['score']:.1f}/10")
-                for factor in risks['demand_risks']['factors']:
-                    st.write(f"• {factor}")
-                
-                st.markdown("#### 🚚 مخاطر سلسلة التوريد")
-                st.metric("الدرجة", f"{risks['supply_chain_risks']['score']:.1f}/10")
-                for factor in risks['supply_chain_risks']['factors']:
-                    st.write(f"• {factor}")
+        render_risk_assessment(model)
         
         # محاكاة السيناريوهات
         st.markdown("---")
@@ -2320,13 +2657,17 @@ def show_enterprise_pricing():
             for scenario_name, results in scenario_results.items():
                 scenario_data.append({
                     'السيناريو': scenario_name,
-                    'السعر المقترح': f"{results['recommended_price']:.2f} ر.س",
+                    'السعر المقترح': results['recommended_price'],
                     'تغير الربح المتوقع': results['expected_profit_change'],
                     'مستوى المخاطرة': results['risk_level']
                 })
             
             df_scenarios = pd.DataFrame(scenario_data)
-            st.dataframe(df_scenarios, use_container_width=True)
+            st.dataframe(
+                df_scenarios,
+                column_config={'السعر المقترح': st.column_config.NumberColumn(format="%.2f ر.س")},
+                use_container_width=True
+            )
     
     with tab6:
         st.markdown("### 🤖 توصيات الذكاء الاصطناعي")
@@ -2400,6 +2741,9 @@ def show_enterprise_pricing():
 
 def show_predictive_ai():
     """صفحة التسعير التنبؤي بالذكاء الاصطناعي"""
+    import plotly.graph_objects as go
+    from predictive_pricing_ai import PredictivePricingAI
+    
     st.markdown('<div class="section-header"><h2>🤖 التسعير التنبؤي بالذكاء الاصطناعي</h2></div>', unsafe_allow_html=True)
     
     # شرح الصفحة
@@ -2771,6 +3115,8 @@ def show_predictive_ai():
 
 def show_comprehensive_system():
     """صفحة النظام الشامل المتكامل"""
+    from comprehensive_pricing_system import ComprehensivePricingEcosystem
+    
     st.markdown('<div class="section-header"><h2>🏆 النظام الشامل المتكامل</h2></div>', unsafe_allow_html=True)
     
     # شرح الصفحة
@@ -3101,6 +3447,9 @@ def show_comprehensive_system():
 
 def show_data_driven_pricing():
     """صفحة التسعير المبني على البيانات"""
+    import plotly.express as px
+    from smart_pricing_engine import SmartPricingEngine, AdvancedPricingEngine
+    
     st.markdown('<div class="section-header"><h2>📊 التسعير المبني على البيانات</h2></div>', unsafe_allow_html=True)
     
     # شرح الصفحة
@@ -3300,13 +3649,8 @@ def show_data_driven_pricing():
                         volume = st.number_input("حجم الطلب", min_value=1, value=100, step=10)
                         urgency = st.selectbox(
                             "مستوى الأهمية",
-                            ['low', 'normal', 'high', 'urgent'],
-                            format_func=lambda x: {
-                                'low': 'منخفض',
-                                'normal': 'عادي',
-                                'high': 'عالي',
-                                'urgent': 'طارئ'
-                            }[x]
+                            _URGENCY_LEVELS,
+                            format_func=_URGENCY_LABELS.__getitem__
                         )
                     
                     if st.button("🎯 احسب السعر الديناميكي", type="primary", use_container_width=True):
@@ -3463,6 +3807,9 @@ def show_data_driven_pricing():
 
 def show_orders_processor():
     """صفحة معالجة بيانات الطلبات"""
+    import plotly.express as px
+    from order_data_processor import OrderDataProcessor, PricingOptimizer, get_data_summary
+    
     st.markdown('<div class="section-header"><h2>📦 معالج بيانات الطلبات</h2></div>', unsafe_allow_html=True)
     
     # شرح الصفحة
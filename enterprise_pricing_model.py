@@ -5,6 +5,11 @@ from scipy.optimize import minimize
 import json
 from advanced_pricing_model import AdvancedPricingModel
 
+
+def _copy_entries(result):
+    """نسخة من نتيجة مخزنة (مع نسخ القواميس الداخلية) حتى لا يعدّل المستدعي النسخة المخزنة"""
+    return {key: dict(value) if isinstance(value, dict) else value for key, value in result.items()}
+
 class EnterprisePricingModel(AdvancedPricingModel):
     """نموذج تسعير متقدم للمؤسسات مع تحليل شامل"""
     
@@ -16,6 +21,10 @@ class EnterprisePricingModel(AdvancedPricingModel):
         self.regulatory_constraints = {}
         self.risk_factors = {}
         
+        # نتائج مخزنة مع رقم نسخة المدخلات التي حُسبت منها
+        self._segment_cache = (None, None)
+        self._risk_cache = (None, None)
+        
     def integrate_sales_history(self, sales_data):
         """دمج بيانات المبيعات التاريخية"""
         self.sales_data = sales_data
@@ -37,6 +46,7 @@ class EnterprisePricingModel(AdvancedPricingModel):
             'historical_monthly_patterns': monthly_patterns.to_dict(),
             'historical_price_elasticity': price_elasticity_historical
         })
+        self._version += 1
     
     def _calculate_historical_elasticity(self):
         """حساب مرونة السعر من البيانات التاريخية"""
@@ -53,18 +63,28 @@ class EnterprisePricingModel(AdvancedPricingModel):
             return max(elasticity, -5.0)  # حد أقصى للمرونة
         return -1.5
     
+    def _cost(self, key, default=0):
+        """قيمة من بيانات التكاليف (أو القيمة الافتراضية إذا لم تُدخل التكاليف بعد)"""
+        return getattr(self.cost_data, key) if self.cost_data is not None else default
+    
     def define_customer_segments(self, segments):
         """تحديد شرائح العملاء"""
         self.customer_segments = segments
+        self._version += 1
         
     def calculate_segmented_pricing(self):
         """حساب التسعير المتمايز للشرائح"""
         segmented_prices = {}
-        base_cost = self.cost_data.get('total_cost_per_unit', 0)
+        base_cost = self._cost('total_cost_per_unit', 0)
         
         if base_cost == 0:
             return {'error': 'يجب إدخال بيانات التكاليف أولاً'}
         
+        # تحسين سعر كل شريحة مكلف، فيُعاد الناتج المخزن ما لم تتغير المدخلات
+        cached_version, cached_prices = self._segment_cache
+        if cached_version == self._version:
+            return _copy_entries(cached_prices)
+        
         for segment_name, segment_data in self.customer_segments.items():
             willingness_to_pay = segment_data.get('willingness_to_pay_multiplier', 1.0)
             price_sensitivity = segment_data.get('price_sensitivity', 1.0)
@@ -82,7 +102,8 @@ class EnterprisePricingModel(AdvancedPricingModel):
                 'willingness_to_pay': willingness_to_pay
             }
         
-        return segmented_prices
+        self._segment_cache = (self._version, segmented_prices)
+        return _copy_entries(segmented_prices)
     
     def _optimize_segment_price(self, base_cost, wtp_multiplier, sensitivity, size):
         """تحسين السعر للشريحة"""
@@ -111,7 +132,7 @@ class EnterprisePricingModel(AdvancedPricingModel):
     
     def _assess_promotional_impact(self, campaign):
         """تقييم تأثير الحملة الترويجية"""
-        base_demand = self.cost_data.get('expected_units', 0)
+        base_demand = self._cost('expected_units', 0)
         discount = campaign.get('discount_percentage', 0)
         duration = campaign.get('duration_days', 30)
         reach = campaign.get('reach_percentage', 0.1)
@@ -141,6 +162,7 @@ class EnterprisePricingModel(AdvancedPricingModel):
     def set_regulatory_constraints(self, constraints):
         """تعيين القيود التنظيمية"""
         self.regulatory_constraints = constraints
+        self._version += 1
     
     def check_regulatory_compliance(self, proposed_price):
         """فحص التوافق التنظيمي"""
@@ -148,7 +170,7 @@ class EnterprisePricingModel(AdvancedPricingModel):
         
         # فحص الحد الأقصى للربح
         max_profit_margin = self.regulatory_constraints.get('max_profit_margin')
-        cost = self.cost_data.get('total_cost_per_unit', 0)
+        cost = self._cost('total_cost_per_unit', 0)
         
         if cost == 0:
             return {'is_compliant': False, 'violations': ['يجب إدخال بيانات التكاليف أولاً'], 'required_adjustments': []}
@@ -172,7 +194,7 @@ class EnterprisePricingModel(AdvancedPricingModel):
     def _suggest_regulatory_adjustments(self, violations, proposed_price):
         """اقتراح تعديلات للتوافق التنظيمي"""
         adjustments = []
-        cost = self.cost_data.get('total_cost_per_unit', 0)
+        cost = self._cost('total_cost_per_unit', 0)
         
         for violation in violations:
             if "هامش الربح" in violation:
@@ -189,6 +211,10 @@ class EnterprisePricingModel(AdvancedPricingModel):
     
     def assess_market_risks(self):
         """تقييم مخاطر السوق"""
+        cached_version, cached_risks = self._risk_cache
+        if cached_version == self._version:
+            return _copy_entries(cached_risks)
+        
         risks = {
             'competitive_risks': self._assess_competitive_risks(),
             'demand_risks': self._assess_demand_risks(),
@@ -199,18 +225,20 @@ class EnterprisePricingModel(AdvancedPricingModel):
         # حساب درجة المخاطر الإجمالية
         total_risk_score = sum(risk['score'] for risk in risks.values()) / len(risks)
         
-        self.risk_factors = {
+        assessed = {
             **risks,
             'overall_risk_score': total_risk_score,
             'risk_level': 'منخفض' if total_risk_score < 3 else 'متوسط' if total_risk_score < 7 else 'مرتفع'
         }
         
-        return self.risk_factors
+        self._risk_cache = (self._version, assessed)
+        self.risk_factors = _copy_entries(assessed)
+        return _copy_entries(assessed)
     
     def _assess_competitive_risks(self):
         """تقييم المخاطر التنافسية"""
         competitor_count = len(self.competitor_data)
-        price_variability = np.std([comp['price'] for comp in self.competitor_data]) if self.competitor_data else 0
+        price_variability = np.std(self.competitor_data['price']) if competitor_count else 0
         
         risk_score = min(competitor_count * 0.5 + price_variability * 0.1, 10)
         
@@ -250,7 +278,7 @@ class EnterprisePricingModel(AdvancedPricingModel):
     def _assess_supply_chain_risks(self):
         """تقييم مخاطر سلسلة التوريد"""
         # افتراض بسيط بناءً على هيكل التكاليف
-        variable_ratio = self.cost_data.get('variable_cost_per_unit', 0) / max(self.cost_data.get('total_cost_per_unit', 1), 1)
+        variable_ratio = self._cost('variable_cost_per_unit', 0) / max(self._cost('total_cost_per_unit', 1), 1)
         risk_score = variable_ratio * 10  # كلما زادت النسبة المتغيرة زادت المخاطر
         
         return {
@@ -267,7 +295,7 @@ class EnterprisePricingModel(AdvancedPricingModel):
             adjusted_market_data = self._adjust_for_scenario(assumptions)
             
             # حساب السعر المقترح
-            base_cost = self.cost_data.get('total_cost_per_unit', 0)
+            base_cost = self._cost('total_cost_per_unit', 0)
             markup = 0.3
             recommended_price = base_cost * (1 + markup)
             
@@ -340,8 +368,8 @@ class EnterprisePricingModel(AdvancedPricingModel):
     
     def _analyze_cost_efficiency(self):
         """تحليل كفاءة التكاليف"""
-        variable_cost = self.cost_data.get('variable_cost_per_unit', 0)
-        total_cost = self.cost_data.get('total_cost_per_unit', 1)
+        variable_cost = self._cost('variable_cost_per_unit', 0)
+        total_cost = self._cost('total_cost_per_unit', 1)
         
         cost_ratio = variable_cost / max(total_cost, 1)
         efficiency_score = 1 - cost_ratio  # كلما ارتفع أفضل